@@ -22,9 +22,82 @@ SESSION_MONGODB_DB = "flask_session"
 # MongoDB URI for Broadway on Demand data.
 MONGO_URI = "mongodb://db:27017/broadway_on_demand"
 
+# Process-level course cache: seconds before a cached course expires, maximum number of cached
+# courses, and whether to invalidate the cache from a change stream on the courses collection
+# (requires MongoDB to run as a replica set; the TTL alone applies otherwise).
+COURSE_CACHE_TTL = 300
+COURSE_CACHE_SIZE = 256
+COURSE_CACHE_WATCH = True
+
+# Buffer Jenkins status pings in each worker and write them in bulk, coalescing repeated pings
+# for the same student and run. Buffered statuses are flushed every JENKINS_STATUS_FLUSH_MS
+# milliseconds, or as soon as JENKINS_STATUS_FLUSH_ITEMS of them are pending.
+JENKINS_STATUS_BUFFER = False
+JENKINS_STATUS_FLUSH_MS = 250
+JENKINS_STATUS_FLUSH_ITEMS = 500
+
+# Run statuses are pushed to student pages as server-sent events. A stream sends a heartbeat
+# every STATUS_STREAM_HEARTBEAT_SECONDS and is closed after STATUS_STREAM_MAX_SECONDS, after
+# which the browser reconnects after STATUS_STREAM_RETRY_MS milliseconds. Each stream holds a
+# gunicorn thread, so a worker serves at most STATUS_STREAM_MAX_STREAMS; pages that get no
+# stream poll instead.
+STATUS_STREAM_HEARTBEAT_SECONDS = 15
+STATUS_STREAM_MAX_SECONDS = 300
+STATUS_STREAM_RETRY_MS = 3000
+STATUS_STREAM_MAX_STREAMS = 16
+
+# Outbound requests to Jenkins, the scheduler and GitHub reuse pooled keep-alive connections,
+# at most HTTP_POOL_SIZE per host and worker. Timeouts are in seconds; idempotent requests are
+# retried up to HTTP_RETRIES times on connection errors and 502/503/504 responses.
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 10
+HTTP_RETRIES = 2
+HTTP_POOL_SIZE = 32
+
+# Seconds a cached Jenkins authorization header is used before the course token is re-read.
+# Headers are also dropped as soon as their course changes or Jenkins rejects them.
+JENKINS_HEADER_TTL = 3600
+
+# Directory where the logs of finished Jenkins jobs are cached gzip-compressed, shared by all
+# workers, and the maximum size of the cached logs in megabytes. None disables the log cache.
+LOG_CACHE_DIR = "/tmp/on-demand-logs"
+LOG_CACHE_MAX_MB = 512
+
+# Seconds the Jenkins worker status shown to staff is reused before it is fetched again.
+JENKINS_WORKERS_TTL = 5
+
+# Seconds a student's latest GitHub commit is reused before it is revalidated with its ETag.
+# The TTL grows automatically, up to GHE_COMMIT_CACHE_MAX_TTL, as the rate limit runs low.
+GHE_COMMIT_CACHE_TTL = 15
+GHE_COMMIT_CACHE_MAX_TTL = 600
+
+# Seconds the student assignment page waits for the latest commit before rendering without it,
+# and the number of threads per worker that load the parts of a page concurrently: from the
+# database, and from GitHub on a separate pool.
+GHE_COMMIT_DEADLINE = 2
+PAGE_LOAD_WORKERS = 16
+PAGE_LOAD_REMOTE_WORKERS = 8
+
+# Split the roster of a scheduled run across several builds of the same grading run: one build
+# per SCHEDULED_RUN_SHARD_SIZE students, or per live Jenkins worker if it is None, and at most
+# SCHEDULED_RUN_MAX_SHARDS builds. Builds are triggered SCHEDULED_RUN_TRIGGER_WORKERS at a time.
+SCHEDULED_RUN_SHARDING = False
+SCHEDULED_RUN_SHARD_SIZE = None
+SCHEDULED_RUN_MAX_SHARDS = 32
+SCHEDULED_RUN_TRIGGER_WORKERS = 8
+
 # Scheduler URI for scheduling runs
 SCHEDULER_URI = "http://localhost:3000/scheduler"
 
+# "http" schedules runs with the scheduler at SCHEDULER_URI; "local" uses the scheduler built
+# into the app, whose leader process renews its lease and reads due runs every
+# SCHEDULER_POLL_SECONDS, loses it after SCHEDULER_LEASE_SECONDS without renewal, and starts at
+# most SCHEDULER_TRIGGER_WORKERS runs at a time.
+SCHEDULER_BACKEND = "http"
+SCHEDULER_POLL_SECONDS = 5
+SCHEDULER_LEASE_SECONDS = 30
+SCHEDULER_TRIGGER_WORKERS = 4
+
 # Broadway API configuration.
 BROADWAY_API_URL = "http://some-broadway-api-server.example/api/v1"
 
@@ -1,2 +1,4 @@
 #!/bin/sh
-gunicorn --workers 5 --bind 0.0.0.0:9090 -m 007 wsgi:app
+set -e
+flask --app wsgi migrate
+gunicorn --workers 5 --worker-class gthread --threads 32 --bind 0.0.0.0:9090 -m 007 wsgi:app
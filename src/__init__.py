@@ -1,3 +1,4 @@
+import click
 from flask import (
     Flask,
     Blueprint,
@@ -14,10 +15,11 @@ from http import HTTPStatus
 from datetime import timedelta
 
 from config import *
-from src import db, auth, common
+from src import db, auth, common, jenkins_api, local_scheduler, sched_api
+from src.commands import Commands
 from src.routes_admin import AdminRoutes
 from src.routes_staff import StaffRoutes
-from src.routes_api import ApiRoutes
+from src.routes_api import ApiRoutes, trigger_scheduled_job
 from src.routes_student import StudentRoutes
 from src.routes_system import SystemRoutes
 from src.template_filters import TemplateFilters
@@ -53,6 +55,24 @@ ApiRoutes(blueprint)
 SystemRoutes(blueprint)
 
 
+def _is_serving():
+    """
+    Whether this process serves requests, under gunicorn or `flask run`, rather than running
+    a command such as `flask --app wsgi migrate`, which imports the app too.
+    """
+    ctx = click.get_current_context(silent=True)
+    return ctx is None or ctx.command.name == "run"
+
+
+# Start the background threads of this worker, warm its Jenkins header cache, and fire
+# scheduled runs in-process when the built-in scheduler is used
+if _is_serving():
+    db.start_background_threads()
+    jenkins_api.prebuild_headers()
+    if sched_api.SCHEDULER_BACKEND == sched_api.LOCAL_BACKEND:
+        local_scheduler.start(trigger_scheduled_job)
+
+
 @blueprint.route("/login/", methods=["GET"])
 @auth.require_no_auth
 def login_page():
@@ -148,6 +168,7 @@ def inject_header_values():
     )
 
 
-# Register blueprint and template filters
+# Register blueprint, template filters and CLI commands
 app.register_blueprint(blueprint)
 TemplateFilters(app)
+Commands(app)
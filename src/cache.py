@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class TTLCache:
+    """
+    A thread-safe, size-bounded LRU cache whose entries also expire after a fixed time to live.
+    Hits and misses are counted so the hit rate can be inspected at runtime.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize, ttl):
+        """
+        :param maxsize: the maximum number of entries kept; the least recently used entry is
+            evicted when it is exceeded.
+        :param ttl: the number of seconds an entry stays valid after it was stored.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped on every invalidation so that a load which raced with it is not stored
+        self._generation = 0
+        # per-key futures of the single-flight loads in progress
+        self._loading = {}
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._MISSING
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return self._MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+            if value is self._MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value, optionally with a time to live other than the cache-wide default.
+        """
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def _store(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get_or_load(self, key, loader, single_flight=False):
+        """
+        Return the cached value for key, calling loader() and caching its result on a miss.
+        None results are cached as well. If the cache is invalidated while loader() runs, the
+        result is returned but not stored, since it may predate the invalidating write.
+        With single_flight, concurrent misses on the same key wait for a single loader() call
+        instead of each calling it, and share its result or exception.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not self._MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+            generation = self._generation
+            if single_flight:
+                future = self._loading.get(key)
+                if future is None:
+                    future = self._loading[key] = Future()
+                    loading = True
+                else:
+                    loading = False
+        if not single_flight:
+            return self._load(key, loader, generation)
+        if not loading:
+            return future.result()
+        try:
+            value = self._load(key, loader, generation)
+        except BaseException as e:
+            # failures are not cached, but every waiter fails with this load rather than
+            # retrying it one after another
+            self._finish_load(key)
+            future.set_exception(e)
+            raise
+        self._finish_load(key)
+        future.set_result(value)
+        return value
+
+    def _finish_load(self, key):
+        with self._lock:
+            self._loading.pop(key, None)
+
+    def _load(self, key, loader, generation):
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                self._store(key, value)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            self._generation += 1
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            }
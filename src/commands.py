@@ -0,0 +1,36 @@
+import click
+
+from src import db
+
+
+class Commands:
+    """
+    Maintenance commands, run with `flask --app wsgi <command>`.
+    """
+
+    def __init__(self, app):
+        @app.cli.command("migrate")
+        def migrate():
+            """Create indexes and bring derived collections up to date. Safe to run on every start."""
+            indexes = db.ensure_indexes()
+            click.echo(f"Ensured {len(indexes)} indexes.")
+            count = db.backfill_enrollments()
+            click.echo(f"Backfilled {count} enrollments.")
+            if not db.has_run_counters():
+                count = db.rebuild_run_counters()
+                click.echo(f"Built {count} run counters.")
+
+        @app.cli.command("rebuild-run-counters")
+        def rebuild_run_counters():
+            """Recompute the per-student run counters from the runs collection."""
+            count = db.rebuild_run_counters()
+            click.echo(f"Built {count} run counters.")
+
+        @app.cli.command("index-report")
+        def index_report():
+            """List declared indexes that are missing and indexes that are never used."""
+            for collection, report in db.index_report().items():
+                for name in report["missing"]:
+                    click.echo(f"{collection}: missing index {name}")
+                for name in report["unused"]:
+                    click.echo(f"{collection}: unused index {name}")
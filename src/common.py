@@ -1,10 +1,11 @@
-from datetime import datetime
+import logging
 
-from pytz import utc
+from pymongo.errors import OperationFailure
 
-from config import TZ
 from src import db, sched_api, util
 
+logger = logging.getLogger(__name__)
+
 
 def wrap_delete_scheduled_run(cid, aid, run_id):
     sched_run = db.get_scheduled_run(cid, aid, run_id)
@@ -27,17 +28,6 @@ def in_grading_period(assignment, now=None):
     return assignment["start"] <= now <= assignment["end"]
 
 
-def is_run_today(run, now):
-    today = datetime.utcfromtimestamp(now).replace(tzinfo=utc).astimezone(TZ).date()
-    run_date = (
-        datetime.utcfromtimestamp(run["timestamp"])
-        .replace(tzinfo=utc)
-        .astimezone(TZ)
-        .date()
-    )
-    return run_date == today
-
-
 def get_available_runs(cid, aid, netid, now=None):
     if now is None:
         now = util.now_timestamp()
@@ -47,13 +37,39 @@ def get_available_runs(cid, aid, netid, now=None):
     if not in_grading_period(assignment, now):
         return 0
 
-    runs = db.get_assignment_runs_for_student(cid, aid, netid)
+    num_runs = db.get_run_count(cid, aid, netid, quota_counter_day(assignment, now))
+    return max(assignment["max_runs"] - num_runs, 0)
+
+
+def quota_counter_day(assignment, now):
+    """
+    Return the run counter an assignment's quota is checked against: today's counter for
+    daily quotas, the all-time counter for total quotas.
+    """
+    if assignment["quota"] == db.Quota.DAILY:
+        return util.local_date(now)
+    return db.RUN_COUNTER_TOTAL
+
+
+def reserve_grading_run(cid, aid, netid, run_id, now=None):
+    """
+    Check and consume one of a student's grading runs, from the assignment quota if any is left
+    and from an active extension otherwise.
+    :return: a reservation for db.release_grading_run, or None if no runs are available.
+    """
+    if now is None:
+        now = util.now_timestamp()
 
-    if assignment["quota"] == db.Quota.TOTAL:
-        return max(assignment["max_runs"] - len(runs), 0)
-    elif assignment["quota"] == db.Quota.DAILY:
-        today_runs = list(filter(lambda r: is_run_today(r, now), runs))
-        return max(assignment["max_runs"] - len(today_runs), 0)
+    assignment = db.get_assignment(cid, aid)
+    if assignment is None:
+        return None
+
+    quota_day = None
+    if in_grading_period(assignment, now):
+        quota_day = quota_counter_day(assignment, now)
+    return db.reserve_grading_run(
+        cid, aid, netid, now, run_id, quota_day, assignment["max_runs"]
+    )
 
 
 def get_active_extensions(cid, aid, netid, now=None):
@@ -67,10 +83,125 @@ def get_active_extensions(cid, aid, netid, now=None):
     return active_extensions, num_extension_runs
 
 
+def get_quota_summary(cid, netid, assignments, now=None):
+    """
+    Compute the quota of every given assignment for one student with two queries, instead
+    of calling get_available_runs and get_active_extensions per assignment.
+    :param cid: a course ID.
+    :param netid: a student's NetID.
+    :param assignments: assignment documents of the course.
+    :return: a dict mapping assignment ID to a (num_available_runs, num_extension_runs)
+        tuple, with the same values the per-assignment functions return.
+    """
+    if now is None:
+        now = util.now_timestamp()
+    aids = [assignment["assignment_id"] for assignment in assignments]
+    run_counts = db.get_run_counts(cid, netid, aids, util.local_date(now))
+    extension_runs = db.sum_active_extension_runs(cid, netid, aids, now)
+
+    summary = {}
+    for assignment in assignments:
+        aid = assignment["assignment_id"]
+        num_available_runs = 0
+        if in_grading_period(assignment, now):
+            num_runs = run_counts.get(aid, {}).get(
+                quota_counter_day(assignment, now), 0
+            )
+            num_available_runs = max(assignment["max_runs"] - num_runs, 0)
+        summary[aid] = (num_available_runs, extension_runs.get(aid, 0))
+    return summary
+
+
+def _assignment_title(assignment):
+    return assignment["name"].replace("_", " ").title()
+
+
+def compute_grade_statistics(cid, netid):
+    """
+    Compute the statistics and score histogram of every graded assignment of a course, on the
+    database server if it supports the summary pipeline, so that the scores of the class are
+    not transferred, and in this process otherwise.
+    :param cid: a course ID.
+    :param netid: a student's NetID.
+    :return: a tuple of a list of GradeEntry dicts without scores, each with the ID of its
+        grade document under "id", and a dict mapping those IDs to the student's raw scores.
+    """
+    try:
+        summaries = db.summarize_course_grades(cid, netid)
+    except OperationFailure as e:
+        logger.warning("Computing grade statistics of %s locally: %s", cid, e)
+    else:
+        assignments = []
+        scores = {}
+        for summary in summaries:
+            result = util.summary_statistics(
+                _assignment_title(summary), summary["type"], summary
+            )
+            result["id"] = str(summary["_id"])
+            assignments.append(result)
+            if summary.get("score") is not None:
+                scores[result["id"]] = summary["score"]
+        return assignments, scores
+
+    grades = db.get_course_grades(cid)
+    assignments = util.compute_statistics_batch(
+        [
+            (
+                _assignment_title(assignment),
+                assignment["type"],
+                [float(student["score"]) for student in assignment["data"]],
+            )
+            for assignment in grades
+        ]
+    )
+    scores = {}
+    for assignment, result in zip(grades, assignments):
+        result["id"] = str(assignment["_id"])
+        for student in assignment["data"]:
+            if student.get("netid") == netid:
+                scores[result["id"]] = student["score"]
+                break
+    return assignments, scores
+
+
+def get_grade_summary(cid, netid):
+    """
+    Get the statistics of every graded assignment of a course together with a student's scores.
+    The statistics are computed once per version of the course's grades and stored, so that
+    all workers share them; a student's page view then only fetches their own scores. If the
+    server cannot compute the version, the statistics are computed on every view.
+    :param cid: a course ID.
+    :param netid: a student's NetID.
+    :return: a list of GradeEntry dicts, newest assignment first.
+    """
+    version = db.get_course_grades_version(cid)
+    stored = db.get_grade_statistics(cid) if version is not None else None
+    if stored is not None and stored["version"] == version:
+        assignments = stored["assignments"]
+        scores = db.get_student_grade_scores(cid, netid)
+    else:
+        assignments, scores = compute_grade_statistics(cid, netid)
+        if version is not None:
+            db.set_grade_statistics(cid, version, assignments)
+
+    summary = []
+    for assignment in assignments:
+        entry = {key: value for key, value in assignment.items() if key != "id"}
+        try:
+            entry["score"] = round(float(scores[assignment["id"]]), 3)
+        except (KeyError, TypeError, ValueError):
+            entry["score"] = 0
+        summary.append(entry)
+    return summary
+
+
 def is_student(netid):
-    """"""
-    courses = db.get_courses_for_student(netid)
-    return bool(courses)
+    """
+    Check whether the given NetID is a student in at least 1 course.
+    :param netid: a user's NetID.
+    :return: a boolean value.
+    """
+    return db.is_enrolled(netid, db.Role.STUDENT)
 
 
 def is_staff(netid):
@@ -79,8 +210,7 @@ def is_staff(netid):
     :param netid: a user's NetID.
     :return: a boolean value.
     """
-    courses = db.get_courses_for_staff(netid)
-    return bool(courses)
+    return db.is_enrolled(netid, db.Role.STAFF)
 
 
 def verify_student(netid, cid):
@@ -90,10 +220,7 @@ def verify_student(netid, cid):
     :param cid: a course ID.
     :return: a boolean value.
     """
-    try:
-        return netid in db.get_course(cid)["student_ids"]
-    except Exception:
-        return []
+    return db.is_enrolled(netid, db.Role.STUDENT, cid)
 
 
 def verify_student_or_staff(netid, cid):
@@ -113,12 +240,7 @@ def verify_admin(netid, cid):
     :param cid: a course ID.
     :return: a boolean value.
     """
-    course = db.get_course(cid)
-    return (
-        course is not None
-        and netid in course["staff"]
-        and course["staff"][netid]["is_admin"]
-    )
+    return db.is_enrolled(netid, db.Role.ADMIN, cid)
 
 
 def verify_staff(netid, cid):
@@ -128,5 +250,4 @@ def verify_staff(netid, cid):
     :param cid: a course ID.
     :return: a boolean value.
     """
-    course = db.get_course(cid)
-    return course is not None and netid in course["staff"]
+    return db.is_enrolled(netid, db.Role.STAFF, cid)
@@ -1,16 +1,64 @@
+import hashlib
+import logging
+import threading
+import time
 import traceback
 from types import NoneType
 from typing import List
+from flask import g, has_app_context
 from flask_pymongo import PyMongo, ASCENDING, DESCENDING
+from pymongo import DeleteOne, IndexModel, ReturnDocument, UpdateOne
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
+from pymongo.errors import (
+    BulkWriteError,
+    DuplicateKeyError,
+    OperationFailure,
+    PyMongoError,
+)
 from src import util
+from src.cache import TTLCache
+from src.status_buffer import StatusBuffer, status_rank
+from src.status_stream import CHANGE_STREAMS_UNSUPPORTED, StatusHub
 from src.common import wrap_delete_scheduled_run
 from src.sched_api import ScheduledRunStatus
 from src.types import StudentInfo
 
+import config
+from config import TZ
+
+logger = logging.getLogger(__name__)
+
 mongo = PyMongo()
 
+# Process-level caches of course documents, keyed by course ID, and of the course lists
+# returned by get_courses_for_student / get_courses_for_staff, keyed by (role, netid).
+# Entries are dropped by write-through invalidation and by the change stream watcher;
+# the TTL bounds staleness when change streams are unavailable.
+COURSE_CACHE_TTL = getattr(config, "COURSE_CACHE_TTL", 300)
+COURSE_CACHE_SIZE = getattr(config, "COURSE_CACHE_SIZE", 256)
+COURSE_CACHE_WATCH = getattr(config, "COURSE_CACHE_WATCH", True)
+COURSE_WATCH_RETRY_SECONDS = 5
+
+_course_cache = TTLCache(COURSE_CACHE_SIZE, COURSE_CACHE_TTL)
+_course_membership_cache = TTLCache(COURSE_CACHE_SIZE * 16, COURSE_CACHE_TTL)
+_course_listeners = []
+
+# Optional write-behind buffer for jenkins_run_status updates, see src/status_buffer.py.
+JENKINS_STATUS_BUFFER = getattr(config, "JENKINS_STATUS_BUFFER", False)
+JENKINS_STATUS_FLUSH_MS = getattr(config, "JENKINS_STATUS_FLUSH_MS", 250)
+JENKINS_STATUS_FLUSH_ITEMS = getattr(config, "JENKINS_STATUS_FLUSH_ITEMS", 500)
+
+_status_buffer = None
+
+# Fans out jenkins_run_status changes to the status streams open in this process; its change
+# stream is only opened once somebody subscribes. Each open stream holds a gunicorn thread, so
+# at most STATUS_STREAM_MAX_STREAMS are open per worker; further viewers poll instead.
+STATUS_STREAM_QUEUE_SIZE = 256
+STATUS_STREAM_MAX_STREAMS = getattr(config, "STATUS_STREAM_MAX_STREAMS", 16)
+
+status_hub = None
+
 
 class Quota:
     DAILY = "daily"
@@ -27,8 +75,317 @@ class Visibility:
     VISIBLE_FROM_START = "visible_from_start"
 
 
+# local_day of the run counter that counts all of a student's runs for an assignment
+RUN_COUNTER_TOTAL = "total"
+
+
+class Role:
+    """
+    Roles stored in the enrollments collection. A course admin has both a STAFF and an ADMIN
+    enrollment.
+    """
+
+    STUDENT = "student"
+    STAFF = "staff"
+    ADMIN = "admin"
+
+
 def init(app):
+    global status_hub
     mongo.init_app(app)
+    status_hub = StatusHub(
+        watch_jenkins_run_statuses,
+        STATUS_STREAM_QUEUE_SIZE,
+        COURSE_WATCH_RETRY_SECONDS,
+        STATUS_STREAM_MAX_STREAMS,
+    )
+
+
+def start_background_threads():
+    """
+    Start the course cache watcher and the status buffer, in processes that serve requests.
+    Without them, cached courses expire after their TTL and statuses are written directly.
+    """
+    global _status_buffer
+    if COURSE_CACHE_WATCH:
+        start_course_watcher()
+    if JENKINS_STATUS_BUFFER:
+        _status_buffer = StatusBuffer(
+            _flush_jenkins_run_statuses,
+            JENKINS_STATUS_FLUSH_MS / 1000,
+            JENKINS_STATUS_FLUSH_ITEMS,
+        )
+        _status_buffer.start()
+
+
+def start_course_watcher():
+    """
+    Start a daemon thread that invalidates cached course documents when the courses
+    collection changes. Change streams require a replica set; if the server does not
+    support them, the watcher exits and the caches fall back to their TTL.
+    """
+    thread = threading.Thread(
+        target=_watch_courses, name="course-cache-watcher", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def _watch_courses():
+    while True:
+        try:
+            with mongo.db["courses"].watch() as stream:
+                # changes made before the stream was opened may have been missed
+                invalidate_all_courses()
+                for change in stream:
+                    cid = change.get("documentKey", {}).get("_id")
+                    if cid is None:
+                        invalidate_all_courses()
+                    else:
+                        _invalidate_cached_course(cid)
+                        # courses are also created and edited outside of the app
+                        sync_course_enrollments(cid)
+        except OperationFailure as e:
+            if e.code != CHANGE_STREAMS_UNSUPPORTED:
+                logger.warning("Course change stream interrupted: %s", e)
+                time.sleep(COURSE_WATCH_RETRY_SECONDS)
+                continue
+            logger.warning(
+                "Course change stream unavailable, falling back to TTL cache: %s", e
+            )
+            return
+        except PyMongoError as e:
+            logger.warning("Course change stream interrupted: %s", e)
+            time.sleep(COURSE_WATCH_RETRY_SECONDS)
+
+
+def _invalidate_cached_course(cid):
+    _course_cache.pop(cid)
+    # membership lists embed whole course documents, and course changes are rare
+    _course_membership_cache.clear()
+    for listener in _course_listeners:
+        listener(cid)
+
+
+def _invalidate_course(cid):
+    """
+    Drop a course from the request memo and from the process-level caches. Called after every
+    write to the courses collection.
+    """
+    _forget(("course", cid))
+    memo = _request_memo()
+    if memo is not None:
+        for key in [key for key in memo if key[0] == "enrollment"]:
+            del memo[key]
+    _invalidate_cached_course(cid)
+
+
+def invalidate_all_courses():
+    _course_cache.clear()
+    _course_membership_cache.clear()
+    for listener in _course_listeners:
+        listener(None)
+
+
+def add_course_listener(listener):
+    """
+    Register a function to call whenever cached course documents are dropped, so that caches of
+    values derived from them can be dropped as well.
+    :param listener: a function taking the ID of the changed course, or None if any course may
+        have changed.
+    """
+    _course_listeners.append(listener)
+
+
+def cache_stats():
+    return {
+        "courses": _course_cache.stats(),
+        "course_membership": _course_membership_cache.stats(),
+    }
+
+
+def status_buffer_stats():
+    return _status_buffer.stats() if _status_buffer is not None else None
+
+
+def status_hub_stats():
+    return status_hub.stats() if status_hub is not None else None
+
+
+def _request_memo():
+    """
+    Return the per-request memo of course and assignment documents, stored on flask.g so that
+    authorization checks, API helpers and route handlers share a single fetch per request.
+    Outside of an app context (e.g. scripts) nothing is memoized and None is returned.
+    """
+    if not has_app_context():
+        return None
+    if "db_memo" not in g:
+        g.db_memo = {}
+    return g.db_memo
+
+
+def _memoized(key, fetch):
+    memo = _request_memo()
+    if memo is None:
+        return fetch()
+    if key not in memo:
+        memo[key] = fetch()
+    return memo[key]
+
+
+def _forget(key):
+    memo = _request_memo()
+    if memo is not None:
+        memo.pop(key, None)
+
+
+def _forget_assignment(cid, aid):
+    _forget(("assignment", cid, aid))
+
+
+# Every index the queries in this module rely on, by collection. ensure_indexes creates them
+# and index_report compares them against what the server has and uses.
+INDEXES = {
+    "enrollments": [
+        IndexModel(
+            [("netid", ASCENDING), ("course_id", ASCENDING), ("role", ASCENDING)],
+            unique=True,
+        ),
+        IndexModel([("course_id", ASCENDING), ("role", ASCENDING)]),
+    ],
+    "assignments": [
+        IndexModel([("course_id", ASCENDING), ("assignment_id", ASCENDING)]),
+    ],
+    "runs": [
+        IndexModel(
+            [
+                ("course_id", ASCENDING),
+                ("assignment_id", ASCENDING),
+                ("netid", ASCENDING),
+                ("timestamp", DESCENDING),
+            ]
+        ),
+    ],
+    "extensions": [
+        IndexModel(
+            [
+                ("course_id", ASCENDING),
+                ("assignment_id", ASCENDING),
+                ("netid", ASCENDING),
+                ("remaining_runs", ASCENDING),
+            ]
+        ),
+        IndexModel([("course_id", ASCENDING), ("netid", ASCENDING)]),
+    ],
+    "scheduled_runs": [
+        IndexModel([("scheduled_run_id", ASCENDING)]),
+        IndexModel(
+            [
+                ("course_id", ASCENDING),
+                ("assignment_id", ASCENDING),
+                ("run_time", DESCENDING),
+            ]
+        ),
+    ],
+    "jenkins_run_status": [
+        # unique so that concurrent status upserts cannot create duplicates
+        IndexModel(
+            [("cid", ASCENDING), ("rid", ASCENDING), ("netid", ASCENDING)],
+            unique=True,
+        ),
+    ],
+    "new_gv_assignments": [
+        IndexModel([("courseId", ASCENDING), ("dueDate", DESCENDING)]),
+    ],
+    "run_counters": [
+        IndexModel(
+            [
+                ("course_id", ASCENDING),
+                ("assignment_id", ASCENDING),
+                ("netid", ASCENDING),
+                ("local_day", ASCENDING),
+            ],
+            unique=True,
+        ),
+    ],
+    "scheduler_jobs": [
+        IndexModel([("status", ASCENDING), ("time", ASCENDING)]),
+    ],
+}
+
+
+def ensure_indexes():
+    """
+    Create every index declared in INDEXES. Existing indexes are left untouched, so this is
+    safe to run on every start.
+    :return: a list of the index names that were declared.
+    """
+    names = []
+    for collection, models in INDEXES.items():
+        try:
+            names += mongo.db[collection].create_indexes(models)
+        except DuplicateKeyError:
+            if collection != "jenkins_run_status":
+                raise
+            # duplicates left behind by racing upserts; keep the furthest status of each run
+            _dedupe_jenkins_run_status()
+            names += mongo.db[collection].create_indexes(models)
+    return names
+
+
+def _dedupe_jenkins_run_status():
+    """
+    Keep one status document per (cid, rid, netid): the one whose status ranks highest. Among
+    equal ranks, the oldest document is kept, since updates went to the first matching
+    document, which is usually the oldest.
+    """
+    duplicates = mongo.db["jenkins_run_status"].aggregate(
+        [
+            {"$sort": {"_id": ASCENDING}},
+            {
+                "$group": {
+                    "_id": {"cid": "$cid", "rid": "$rid", "netid": "$netid"},
+                    "docs": {"$push": {"_id": "$_id", "status": "$status"}},
+                    "count": {"$sum": 1},
+                }
+            },
+            {"$match": {"count": {"$gt": 1}}},
+        ]
+    )
+    for duplicate in duplicates:
+        # max keeps the first, i.e. oldest, of the documents with the highest rank
+        keep = max(duplicate["docs"], key=lambda doc: status_rank(doc.get("status")))
+        mongo.db["jenkins_run_status"].delete_many(
+            {
+                "_id": {
+                    "$in": [doc["_id"] for doc in duplicate["docs"] if doc is not keep]
+                }
+            }
+        )
+
+
+def index_report():
+    """
+    Compare the declared indexes with the ones on the server.
+    :return: a dict mapping each collection to the declared indexes that are missing and the
+        existing indexes that have not been used since the server started.
+    """
+    report = {}
+    for collection, models in INDEXES.items():
+        existing = mongo.db[collection].index_information()
+        declared = [model.document["name"] for model in models]
+        usage = {
+            stats["name"]: stats["accesses"]["ops"]
+            for stats in mongo.db[collection].aggregate([{"$indexStats": {}}])
+        }
+        report[collection] = {
+            "missing": [name for name in declared if name not in existing],
+            "unused": [
+                name for name, ops in usage.items() if ops == 0 and name != "_id_"
+            ],
+        }
+    return report
 
 
 def get_user(netid):
@@ -44,32 +401,157 @@ def get_courses_for_student_or_staff(netid):
     return student_course
 
 
+def _find_courses_by_role(netid: str, role: str):
+    cids = [
+        enrollment["course_id"]
+        for enrollment in mongo.db["enrollments"].find(
+            {"netid": netid, "role": role}, {"_id": 0, "course_id": 1}
+        )
+    ]
+    if not cids:
+        return []
+    return list(mongo.db["courses"].find({"_id": {"$in": cids}}))
+
+
 def get_courses_for_student(netid: str):
-    return list(mongo.db["courses"].find({"student_ids": netid}))
+    courses = _course_membership_cache.get_or_load(
+        (Role.STUDENT, netid), lambda: _find_courses_by_role(netid, Role.STUDENT)
+    )
+    return list(courses)
 
 
 def get_courses_for_staff(netid: str):
-    return list(mongo.db["courses"].find({f"staff.{netid}": {"$exists": True}}))
+    courses = _course_membership_cache.get_or_load(
+        (Role.STAFF, netid), lambda: _find_courses_by_role(netid, Role.STAFF)
+    )
+    return list(courses)
+
+
+def is_enrolled(netid: str, role: str, cid: str | NoneType = None):
+    """
+    Check whether a user holds a role in the given course, or in any course if cid is None.
+    Only indexed fields are filtered on and projected, so the lookup is covered by the
+    (netid, course_id, role) index and never loads a roster.
+    """
+    query = {"netid": netid, "role": role}
+    if cid is not None:
+        query["course_id"] = cid
+    return _memoized(
+        ("enrollment", netid, role, cid),
+        lambda: mongo.db["enrollments"].find_one(query, {"_id": 0, "netid": 1})
+        is not None,
+    )
+
+
+def _enroll(cid: str, netid: str, role: str):
+    enrollment = {"course_id": cid, "netid": netid, "role": role}
+    mongo.db["enrollments"].update_one(enrollment, {"$set": enrollment}, upsert=True)
+
+
+def _unenroll(cid: str, netid: str, *roles: str):
+    mongo.db["enrollments"].delete_many(
+        {"course_id": cid, "netid": netid, "role": {"$in": list(roles)}}
+    )
+
+
+def _course_enrollments(course):
+    """
+    Derive the set of (netid, role) enrollments from the rosters embedded in a course document.
+    """
+    enrollments = {(netid, Role.STUDENT) for netid in course.get("student_ids", [])}
+    for netid, staff_info in course.get("staff", {}).items():
+        enrollments.add((netid, Role.STAFF))
+        if staff_info.get("is_admin"):
+            enrollments.add((netid, Role.ADMIN))
+    return enrollments
+
+
+def sync_course_enrollments(cid: str):
+    """
+    Reconcile the enrollments of one course with its course document, removing all of them if
+    the course no longer exists.
+    :return: the number of enrollments the course has afterwards.
+    """
+    course = mongo.db["courses"].find_one({"_id": cid}, {"student_ids": 1, "staff": 1})
+    wanted = _course_enrollments(course) if course else set()
+    existing = {
+        (enrollment["netid"], enrollment["role"]): enrollment["_id"]
+        for enrollment in mongo.db["enrollments"].find(
+            {"course_id": cid}, {"netid": 1, "role": 1}
+        )
+    }
+    ops = [
+        UpdateOne(
+            {"course_id": cid, "netid": netid, "role": role},
+            {"$set": {"course_id": cid, "netid": netid, "role": role}},
+            upsert=True,
+        )
+        for netid, role in wanted - existing.keys()
+    ]
+    ops += [DeleteOne({"_id": existing[key]}) for key in existing.keys() - wanted]
+    if ops:
+        mongo.db["enrollments"].bulk_write(ops, ordered=False)
+    return len(wanted)
+
+
+def backfill_enrollments():
+    """
+    Rebuild the enrollments collection from the rosters embedded in course documents. Safe to
+    run repeatedly.
+    :return: the total number of enrollments.
+    """
+    cids = mongo.db["courses"].distinct("_id")
+    total = sum(sync_course_enrollments(cid) for cid in cids)
+    mongo.db["enrollments"].delete_many({"course_id": {"$nin": cids}})
+    invalidate_all_courses()
+    return total
 
 
 def get_course(cid: str):
-    return mongo.db["courses"].find_one({"_id": cid})
+    """
+    Fetch a course document. The result is served from the process-level course cache and
+    memoized for the rest of the current request, so callers must not mutate it.
+    """
+    return _memoized(
+        ("course", cid),
+        lambda: _course_cache.get_or_load(
+            cid, lambda: mongo.db["courses"].find_one({"_id": cid})
+        ),
+    )
+
+
+def get_course_tokens():
+    """
+    Fetch the Jenkins token of every course with one query.
+    :return: a list of documents with _id and token keys.
+    """
+    return list(
+        mongo.db["courses"].find({"token": {"$exists": True}}, {"_id": 1, "token": 1})
+    )
 
 
 def add_staff_to_course(cid: str, new_staff_id: str):
-    return mongo.db["courses"].update_one(
+    res = mongo.db["courses"].update_one(
         {"_id": cid}, {"$set": {f"staff.{new_staff_id}": {"is_admin": False}}}
     )
+    if res.matched_count:
+        _unenroll(cid, new_staff_id, Role.ADMIN)
+        _enroll(cid, new_staff_id, Role.STAFF)
+    _invalidate_course(cid)
+    return res
 
 
 def remove_staff_from_course(cid, staff_id):
-    return mongo.db["courses"].update_one(
+    res = mongo.db["courses"].update_one(
         {"_id": cid}, {"$unset": {f"staff.{staff_id}": 1}}
     )
+    _unenroll(cid, staff_id, Role.STAFF, Role.ADMIN)
+    _invalidate_course(cid)
+    return res
 
 
 def add_student_to_course(cid: str, student_info: StudentInfo):
-    return mongo.db["courses"].update_one(
+    res = mongo.db["courses"].update_one(
         {"_id": cid},
         {
             "$addToSet": {
@@ -78,10 +560,14 @@ def add_student_to_course(cid: str, student_info: StudentInfo):
             }
         },
     )
+    if res.matched_count:
+        _enroll(cid, student_info["netid"], Role.STUDENT)
+    _invalidate_course(cid)
+    return res
 
 
 def remove_student_from_course(cid: str, student_id: str):
-    return mongo.db["courses"].update_one(
+    res = mongo.db["courses"].update_one(
         {"_id": cid},
         {
             "$pull": {
@@ -90,27 +576,41 @@ def remove_student_from_course(cid: str, student_id: str):
             }
         },
     )
+    _unenroll(cid, student_id, Role.STUDENT)
+    _invalidate_course(cid)
+    return res
 
 
 def add_admin_to_course(cid: str, staff_id: str):
-    return mongo.db["courses"].update_one(
+    res = mongo.db["courses"].update_one(
         {"_id": cid}, {"$set": {f"staff.{staff_id}.is_admin": True}}
     )
+    if res.matched_count:
+        _enroll(cid, staff_id, Role.ADMIN)
+    _invalidate_course(cid)
+    return res
 
 
 def remove_admin_from_course(cid: str, staff_id: str):
-    return mongo.db["courses"].update_one(
+    res = mongo.db["courses"].update_one(
         {"_id": cid}, {"$set": {f"staff.{staff_id}.is_admin": False}}
     )
+    _unenroll(cid, staff_id, Role.ADMIN)
+    _invalidate_course(cid)
+    return res
 
 
 def overwrite_student_roster(cid: str, students: List[StudentInfo]):
     student_ids = list(map(lambda student: student["netid"], students))
 
-    return mongo.db["courses"].update_one(
+    res = mongo.db["courses"].update_one(
         {"_id": cid},
         {"$set": {"student_ids": student_ids, "student_enhanced_mapping": students}},
     )
+    if res.matched_count:
+        sync_course_enrollments(cid)
+    _invalidate_course(cid)
+    return res
 
 
 def get_assignments_for_course(cid: str, visible_only: bool = False):
@@ -129,7 +629,16 @@ def get_assignments_for_course(cid: str, visible_only: bool = False):
 
 
 def get_assignment(cid: str, aid: str):
-    return mongo.db["assignments"].find_one({"course_id": cid, "assignment_id": aid})
+    """
+    Fetch an assignment document. Like get_course, the result is memoized for the rest of the
+    current request.
+    """
+    return _memoized(
+        ("assignment", cid, aid),
+        lambda: mongo.db["assignments"].find_one(
+            {"course_id": cid, "assignment_id": aid}
+        ),
+    )
 
 
 def add_assignment(
@@ -138,6 +647,7 @@ def add_assignment(
     if not Quota.is_valid(quota):
         raise RuntimeError("Invalid quota type for assignment.")
 
+    _forget_assignment(cid, aid)
     mongo.db["assignments"].insert_one(
         {
             "course_id": cid,
@@ -157,6 +667,7 @@ def update_assignment(
     if not Quota.is_valid(quota):
         raise RuntimeError("Invalid quota type for assignment.")
 
+    _forget_assignment(cid, aid)
     res = mongo.db["assignments"].update_one(
         {"course_id": cid, "assignment_id": aid},
         {
@@ -174,8 +685,10 @@ def update_assignment(
 
 def remove_assignment(cid: str, aid: str):
     delete_filter = {"course_id": cid, "assignment_id": aid}
+    _forget_assignment(cid, aid)
     mongo.db["extensions"].delete_many(delete_filter)
     mongo.db["runs"].delete_many(delete_filter)
+    mongo.db["run_counters"].delete_many(delete_filter)
     res = mongo.db["assignments"].delete_many(delete_filter)
     # delete scheduled runs for this assignment
     mongo.db["scheduled_runs"].delete_many(delete_filter)
@@ -190,6 +703,147 @@ def get_assignment_runs_for_student(cid: str, aid: str, netid: str):
     )
 
 
+def get_run_count(cid: str, aid: str, netid: str, local_day: str):
+    """
+    Read a student's run counter for an assignment: either the count for one day of the server
+    time zone ("YYYY-MM-DD") or, with RUN_COUNTER_TOTAL, the count of all runs.
+    """
+    counter = mongo.db["run_counters"].find_one(
+        {
+            "course_id": cid,
+            "assignment_id": aid,
+            "netid": netid,
+            "local_day": local_day,
+        },
+        {"_id": 0, "count": 1},
+    )
+    return counter["count"] if counter else 0
+
+
+def get_run_counts(cid: str, netid: str, aids: List[str], local_day: str):
+    """
+    Read a student's run counters for several assignments in one query.
+    :return: a dict mapping assignment ID to a dict of counts keyed by local_day and
+        RUN_COUNTER_TOTAL. Assignments without runs are omitted.
+    """
+    counters = mongo.db["run_counters"].find(
+        {
+            "course_id": cid,
+            "assignment_id": {"$in": aids},
+            "netid": netid,
+            "local_day": {"$in": [local_day, RUN_COUNTER_TOTAL]},
+        },
+        {"_id": 0, "assignment_id": 1, "local_day": 1, "count": 1},
+    )
+    counts = {}
+    for counter in counters:
+        counts.setdefault(counter["assignment_id"], {})[counter["local_day"]] = counter[
+            "count"
+        ]
+    return counts
+
+
+def _count_run(
+    cid: str, aid: str, netid: str, timestamp: float, delta: int, skip_day=None
+):
+    key = {"course_id": cid, "assignment_id": aid, "netid": netid}
+    mongo.db["run_counters"].bulk_write(
+        [
+            UpdateOne(
+                {**key, "local_day": local_day},
+                {"$inc": {"count": delta}},
+                upsert=True,
+            )
+            for local_day in (util.local_date(timestamp), RUN_COUNTER_TOTAL)
+            if local_day != skip_day
+        ],
+        ordered=False,
+    )
+
+
+def _consume_run_counter(counter: dict, max_runs: int):
+    """
+    Increment a run counter only if it is below max_runs, as a single server-side operation.
+    :return: True if the counter was incremented.
+    """
+    if max_runs <= 0:
+        return False
+    query = {**counter, "count": {"$lt": max_runs}}
+    try:
+        mongo.db["run_counters"].update_one(query, {"$inc": {"count": 1}}, upsert=True)
+        return True
+    except DuplicateKeyError:
+        # the counter exists, so the quota is used up or a concurrent reservation created it
+        res = mongo.db["run_counters"].update_one(query, {"$inc": {"count": 1}})
+        return res.modified_count == 1
+
+
+def has_run_counters():
+    return mongo.db["run_counters"].find_one({}, {"_id": 1}) is not None
+
+
+def rebuild_run_counters():
+    """
+    Recompute the run_counters collection from the runs collection. The counters are built in a
+    staging collection and swapped in with a rename; runs added while the rebuild is in
+    progress are not counted, so run this while the app is not serving traffic.
+    :return: the number of counters written.
+    """
+    staging = mongo.db["run_counters_rebuild"]
+    staging.drop()
+    staging.create_indexes(INDEXES["run_counters"])
+    run_date = {"$toDate": {"$multiply": ["$timestamp", 1000]}}
+    daily = {
+        "$dateToString": {"format": "%Y-%m-%d", "date": run_date, "timezone": TZ.zone}
+    }
+    for local_day in (daily, {"$literal": RUN_COUNTER_TOTAL}):
+        mongo.db["runs"].aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": {
+                            "course_id": "$course_id",
+                            "assignment_id": "$assignment_id",
+                            "netid": "$netid",
+                            "local_day": local_day,
+                        },
+                        "count": {"$sum": 1},
+                    }
+                },
+                {"$replaceWith": {"$mergeObjects": ["$_id", {"count": "$count"}]}},
+                {"$merge": {"into": staging.name}},
+            ]
+        )
+    count = staging.count_documents({})
+    staging.rename("run_counters", dropTarget=True)
+    return count
+
+
+def sum_active_extension_runs(cid: str, netid: str, aids: List[str], now):
+    """
+    Sum the remaining runs of a student's active extensions for several assignments in one
+    aggregation.
+    :return: a dict mapping assignment ID to remaining extension runs. Assignments without
+        active extensions are omitted.
+    """
+    sums = mongo.db["extensions"].aggregate(
+        [
+            {
+                "$match": {
+                    "course_id": cid,
+                    "netid": netid,
+                    "assignment_id": {"$in": aids},
+                    "remaining_runs": {"$gt": 0},
+                    "start": {"$lte": now},
+                    "end": {"$gte": now},
+                }
+            },
+            {"$group": {"_id": "$assignment_id", "runs": {"$sum": "$remaining_runs"}}},
+        ]
+    )
+    return {total["_id"]: total["runs"] for total in sums}
+
+
 def get_assignment_runs(cid: str, aid: str):
     return mongo.db["runs"].aggregate(
         [
@@ -237,6 +891,7 @@ def add_grading_run(
         )
 
     mongo.db["runs"].insert_one(new_run)
+    _count_run(cid, aid, netid, timestamp, 1)
 
 def remove_grading_run(cid, aid, netid, run_id, extension_used: str | NoneType = None):
     run = {
@@ -245,9 +900,10 @@ def remove_grading_run(cid, aid, netid, run_id, extension_used: str | NoneType =
         "assignment_id": aid,
         "netid": netid,
     }
-    result = mongo.db["runs"].delete_one(run)
-    if result.deleted_count != 1:
+    removed = mongo.db["runs"].find_one_and_delete(run)
+    if removed is None:
         return
+    _count_run(cid, aid, netid, removed["timestamp"], -1)
 
     if extension_used:
         mongo.db["extensions"].update_one(
@@ -255,6 +911,65 @@ def remove_grading_run(cid, aid, netid, run_id, extension_used: str | NoneType =
             {"$set": {"_id": extension_used["_id"]}, "$inc": {"remaining_runs": 1}}
         )
 
+def reserve_grading_run(
+    cid: str,
+    aid: str,
+    netid: str,
+    timestamp: float,
+    run_id: str,
+    quota_day: str | NoneType,
+    max_runs: int,
+):
+    """
+    Atomically consume one grading run and record it. The run is taken from the quota counter
+    for quota_day if it is below max_runs, otherwise from the student's active extension that
+    expires first. Both checks are conditional updates, so concurrent requests cannot
+    overspend.
+    :param quota_day: the run counter the quota is checked against, or None to only consider
+        extensions (e.g. outside the grading period).
+    :return: a reservation to pass to release_grading_run if the run could not be started, or
+        None if no runs are available.
+    """
+    key = {"course_id": cid, "assignment_id": aid, "netid": netid}
+    extension_used = None
+    if quota_day is None or not _consume_run_counter(
+        {**key, "local_day": quota_day}, max_runs
+    ):
+        extension_used = mongo.db["extensions"].find_one_and_update(
+            {
+                **key,
+                "remaining_runs": {"$gt": 0},
+                "start": {"$lte": timestamp},
+                "end": {"$gte": timestamp},
+            },
+            {"$inc": {"remaining_runs": -1}},
+            projection={"_id": 1},
+            sort=[("end", ASCENDING)],
+        )
+        if extension_used is None:
+            return None
+        quota_day = None
+
+    mongo.db["runs"].insert_one({"_id": run_id, **key, "timestamp": timestamp})
+    # the quota counter has already been incremented by the reservation
+    _count_run(cid, aid, netid, timestamp, 1, skip_day=quota_day)
+    return {"run_id": run_id, "extension_used": extension_used}
+
+
+def release_grading_run(cid: str, aid: str, netid: str, reservation: dict):
+    """
+    Undo a reservation made by reserve_grading_run, returning the run to its quota or
+    extension.
+    """
+    remove_grading_run(
+        cid,
+        aid,
+        netid,
+        reservation["run_id"],
+        extension_used=reservation["extension_used"],
+    )
+
+
 def get_grading_run(run_id: str):
     return mongo.db["runs"].find_one({"_id": run_id})
 
@@ -267,6 +982,7 @@ def get_extensions(cid: str, aid: str, netid: str | NoneType = None):
 
 
 def pair_assignment_final_grading_run(cid: str, aid: str, scheduled_run_id: ObjectId):
+    _forget_assignment(cid, aid)
     return mongo.db["assignments"].update_one(
         {"course_id": cid, "assignment_id": aid},
         {"$set": {"final_grading_run_id": str(scheduled_run_id)}},
@@ -291,6 +1007,70 @@ def add_extension(
     )
 
 
+def add_extensions(
+    cid,
+    aid,
+    netids,
+    max_runs,
+    start,
+    end,
+    run_time=None,
+    due_time=None,
+    scheduled_run_id=None,
+):
+    """
+    Grant the same extension to many students, with one insert for the extensions and one for
+    their scheduled runs. Each student gets their own scheduled run, so that it is deleted with
+    their extension, but all of the runs share one scheduler job and are started in one build.
+    :param run_time: the run time of the scheduled runs, or None to add no scheduled runs.
+    :param due_time: the due time of the scheduled runs.
+    :param scheduled_run_id: the scheduler job of the scheduled runs.
+    """
+    run_ids = [ObjectId() if run_time is not None else None for _ in netids]
+    sched_runs = [
+        {
+            "_id": run_id,
+            "course_id": cid,
+            "assignment_id": aid,
+            "run_time": run_time,
+            "due_time": due_time,
+            "roster": [netid],
+            "name": f"Extension Run - {netid}",
+            "scheduled_run_id": scheduled_run_id,
+            "broadway_run_id": None,
+            "status": ScheduledRunStatus.SCHEDULED,
+        }
+        for netid, run_id in zip(netids, run_ids)
+        if run_id is not None
+    ]
+    if sched_runs:
+        mongo.db["scheduled_runs"].insert_many(sched_runs)
+    try:
+        return mongo.db["extensions"].insert_many(
+            [
+                {
+                    "course_id": cid,
+                    "assignment_id": aid,
+                    "netid": netid,
+                    "max_runs": max_runs,
+                    "remaining_runs": max_runs,
+                    "start": start,
+                    "end": end,
+                    "run_id": str(run_id) if run_id else None,
+                    "userRequested": False,
+                }
+                for netid, run_id in zip(netids, run_ids)
+            ]
+        )
+    except PyMongoError:
+        # runs without an extension would still be started
+        if sched_runs:
+            mongo.db["scheduled_runs"].delete_many(
+                {"_id": {"$in": [run["_id"] for run in sched_runs]}}
+            )
+        raise
+
+
 def delete_extension(cid: str, aid: str, extension_id: str):
     try:
         document = mongo.db["extensions"].find_one({"_id": ObjectId(extension_id)})
@@ -355,6 +1135,61 @@ def update_scheduled_run_bw_run_id(rid, bw_run_id):
     return res.modified_count > 0
 
 
+def find_scheduler_job(cid, aid, run_time, due_time):
+    """
+    Find the scheduler job of a pending scheduled run with the same run time and due time, so
+    that another run can share it and be coalesced into the same build.
+    :return: a scheduler job ID, or None if there is no such run.
+    """
+    sched_run = mongo.db["scheduled_runs"].find_one(
+        {
+            "course_id": cid,
+            "assignment_id": aid,
+            "run_time": run_time,
+            "due_time": due_time,
+            "status": ScheduledRunStatus.SCHEDULED,
+        },
+        {"scheduled_run_id": 1},
+    )
+    return sched_run["scheduled_run_id"] if sched_run is not None else None
+
+
+def claim_scheduled_runs(cid, aid, run_time, due_time, bw_run_id):
+    """
+    Mark every pending scheduled run with the given run time and due time as ran by one build.
+    Each run is claimed atomically, so concurrent triggers never start a run twice.
+    :return: the claimed scheduled runs.
+    """
+    mongo.db["scheduled_runs"].update_many(
+        {
+            "course_id": cid,
+            "assignment_id": aid,
+            "run_time": run_time,
+            "due_time": due_time,
+            "status": ScheduledRunStatus.SCHEDULED,
+        },
+        {"$set": {"status": ScheduledRunStatus.RAN, "broadway_run_id": bw_run_id}},
+    )
+    return list(
+        mongo.db["scheduled_runs"].find(
+            {"course_id": cid, "assignment_id": aid, "broadway_run_id": bw_run_id}
+        )
+    )
+
+
+def set_scheduled_runs_outcome(rids, status, shards=None):
+    """
+    Record the outcome of the build of claimed scheduled runs.
+    :param status: a ScheduledRunStatus.
+    :param shards: the builds of a sharded run, as returned by
+        jenkins_api.start_sharded_grading_run.
+    """
+    update = {"status": status}
+    if shards is not None:
+        update["shards"] = shards
+    mongo.db["scheduled_runs"].update_many({"_id": {"$in": rids}}, {"$set": update})
+
+
 def get_scheduled_run(cid, aid, rid):
     try:
         return mongo.db["scheduled_runs"].find_one(
@@ -380,14 +1215,117 @@ def delete_scheduled_run(cid, aid, rid):
         return False
 
 
-def set_jenkins_run_status(cid, rid, status, build_url, netid):
+def set_jenkins_run_status(cid, rid, status, build_url, netid, buffered=True):
+    """
+    Save the status of a student's job in a run, through the status buffer if it is enabled.
+    :param buffered: False to write the status immediately, e.g. when a page showing it is
+        about to be loaded.
+    """
+    if buffered and _status_buffer is not None:
+        _status_buffer.add(
+            {
+                "cid": cid,
+                "rid": rid,
+                "netid": netid,
+                "status": status,
+                "build_url": build_url,
+            }
+        )
+        return
     mongo.db["jenkins_run_status"].update_one(
-        {"cid": cid, "rid": rid, "netid": netid},
-        {"$set": {"status": status, "build_url": build_url}},
+        *_jenkins_run_status_update(
+            {
+                "cid": cid,
+                "rid": rid,
+                "netid": netid,
+                "status": status,
+                "build_url": build_url,
+            }
+        ),
         upsert=True,
     )
 
 
+def _jenkins_run_status_update(update):
+    """
+    Build the filter and pipeline update saving a job status. The rank of the saved status is
+    stored with it, and a status never replaces one of a higher rank, so a late "running" cannot
+    overwrite "success" whichever worker or flush writes it. Documents saved before ranks were
+    stored count as rank 0.
+    :return: a (filter, update) tuple.
+    """
+    rank = status_rank(update["status"])
+    newer = {"$gte": [rank, {"$ifNull": ["$status_rank", 0]}]}
+
+    def pick(field, value):
+        return {"$cond": [newer, {"$literal": value}, "$" + field]}
+
+    return (
+        {"cid": update["cid"], "rid": update["rid"], "netid": update["netid"]},
+        [
+            {
+                "$set": {
+                    "status": pick("status", update["status"]),
+                    "build_url": pick("build_url", update["build_url"]),
+                    "status_rank": pick("status_rank", rank),
+                }
+            }
+        ],
+    )
+
+
+def _jenkins_run_status_upsert(update):
+    return UpdateOne(*_jenkins_run_status_update(update), upsert=True)
+
+
+def set_jenkins_run_statuses(updates):
+    """
+    Save many status updates with one unordered bulk write. When a key appears more than once,
+    the last update of the highest status rank wins, and no update replaces a saved status of
+    a higher rank. If the status buffer is enabled, the updates are buffered instead and
+    reported as saved.
+    :param updates: a list of dicts with cid, rid, netid, status and build_url keys.
+    :return: a list with, for each update, None if it was saved or an error message otherwise.
+    """
+    if _status_buffer is not None:
+        for update in updates:
+            _status_buffer.add(update)
+        return [None] * len(updates)
+    return _write_jenkins_run_statuses(updates)
+
+
+def _write_jenkins_run_statuses(updates):
+    keys = [(update["cid"], update["rid"], update["netid"]) for update in updates]
+    # of the updates of a key, the last one of the highest rank is saved, as in StatusBuffer
+    latest = {}
+    for i, key in enumerate(keys):
+        j = latest.get(key)
+        if j is None or status_rank(updates[i]["status"]) >= status_rank(
+            updates[j]["status"]
+        ):
+            latest[key] = i
+    indices = sorted(latest.values())
+    ops = [_jenkins_run_status_upsert(updates[i]) for i in indices]
+    errors = [None] * len(updates)
+    if not ops:
+        return errors
+    try:
+        mongo.db["jenkins_run_status"].bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details["writeErrors"]:
+            errors[indices[error["index"]]] = error["errmsg"]
+    # superseded updates share the outcome of the update that replaced them
+    return [errors[latest[key]] for key in keys]
+
+
+def _flush_jenkins_run_statuses(updates):
+    errors = [error for error in _write_jenkins_run_statuses(updates) if error]
+    if errors:
+        logger.error(
+            "Failed to save %d buffered job statuses: %s", len(errors), errors[0]
+        )
+
+
 def get_jenkins_run_status_single(cid, rid, netid):
     try:
         query = {"cid": cid, "rid": rid, "netid": netid}
@@ -402,6 +1340,41 @@ def get_jenkins_run_status_single(cid, rid, netid):
         return {}
 
 
+def get_jenkins_run_statuses(cid, rids, netid=None):
+    """
+    Get the statuses of many runs with one query.
+    :param cid: a course ID.
+    :param rids: a list of run IDs.
+    :param netid: if given, only this student's statuses are returned.
+    :return: a list of status documents with cid, rid, netid, status and build_url keys.
+    """
+    query = {"cid": cid, "rid": {"$in": list(rids)}}
+    if netid:
+        query["netid"] = netid
+    return list(mongo.db["jenkins_run_status"].find(query, {"_id": 0}))
+
+
+def watch_jenkins_run_statuses(callback, on_open=None):
+    """
+    Follow the jenkins_run_status collection, calling callback with every inserted or updated
+    status document, until the change stream is interrupted.
+    :param on_open: a function called once the change stream is open.
+    :raises OperationFailure: with code CHANGE_STREAMS_UNSUPPORTED if the server does not
+        support change streams.
+    """
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+    with mongo.db["jenkins_run_status"].watch(
+        pipeline, full_document="updateLookup"
+    ) as stream:
+        if on_open is not None:
+            on_open()
+        for change in stream:
+            doc = change.get("fullDocument")
+            if doc is not None:
+                doc.pop("_id", None)
+                callback(doc)
+
+
 def get_jenkins_run_status_all(cid, rid):
     try:
         response = mongo.db["jenkins_run_status"].find(
@@ -412,22 +1385,429 @@ def get_jenkins_run_status_all(cid, rid):
         print(e, flush=True)
         return []
 
+SCHEDULER_LEASE_ID = "scheduler"
+
+
+class SchedulerJobStatus:
+    PENDING = "pending"
+    FIRING = "firing"
+    FIRED = "fired"
+    FAILED = "failed"
+
+
+def acquire_scheduler_lease(owner, seconds):
+    """
+    Take or renew the lease that makes one process the leader of the local scheduler.
+    :param owner: a name unique to the calling process.
+    :param seconds: how long the lease is held without renewal.
+    :return: whether the caller holds the lease.
+    """
+    now = time.time()
+    try:
+        mongo.db["scheduler_lease"].find_one_and_update(
+            {
+                "_id": SCHEDULER_LEASE_ID,
+                "$or": [{"owner": owner}, {"expires": {"$lt": now}}],
+            },
+            {"$set": {"owner": owner, "expires": now + seconds}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return True
+    except DuplicateKeyError:
+        # held by another process
+        return False
+
+
+def release_scheduler_lease(owner):
+    mongo.db["scheduler_lease"].update_one(
+        {"_id": SCHEDULER_LEASE_ID, "owner": owner}, {"$set": {"expires": 0}}
+    )
+
+
+def add_scheduler_job(job_id, run_time, cid, aid):
+    mongo.db["scheduler_jobs"].insert_one(
+        {
+            "_id": job_id,
+            "time": run_time,
+            "course_id": cid,
+            "assignment_id": aid,
+            "status": SchedulerJobStatus.PENDING,
+        }
+    )
+
+
+def update_scheduler_job(job_id, run_time):
+    res = mongo.db["scheduler_jobs"].update_one(
+        {"_id": job_id}, {"$set": {"time": run_time, "status": SchedulerJobStatus.PENDING}}
+    )
+    return res.matched_count == 1
+
+
+def delete_scheduler_job(job_id):
+    return mongo.db["scheduler_jobs"].delete_one({"_id": job_id}).deleted_count == 1
+
+
+def _fireable_scheduler_jobs(stale_before):
+    # jobs whose firing was started by a leader that did not finish it before stale_before
+    return {
+        "$or": [
+            {"status": SchedulerJobStatus.PENDING},
+            {"status": SchedulerJobStatus.FIRING, "claimed_at": {"$lt": stale_before}},
+        ]
+    }
+
+
+def get_due_scheduler_jobs(until, stale_before):
+    """
+    :return: the scheduler jobs due before `until` that have not been fired, including the jobs
+        whose firing was started before `stale_before` but never finished.
+    """
+    return list(
+        mongo.db["scheduler_jobs"].find(
+            {"time": {"$lte": until}, **_fireable_scheduler_jobs(stale_before)},
+            {"time": 1},
+        )
+    )
+
+
+def claim_scheduler_job(job_id, run_time, stale_before):
+    """
+    Mark a scheduler job as firing, unless it has been fired, deleted or moved to another time
+    meanwhile.
+    :return: the job, or None if it was not claimed.
+    """
+    return mongo.db["scheduler_jobs"].find_one_and_update(
+        {"_id": job_id, "time": run_time, **_fireable_scheduler_jobs(stale_before)},
+        {"$set": {"status": SchedulerJobStatus.FIRING, "claimed_at": time.time()}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def renew_scheduler_job_claims(job_ids):
+    """
+    Keep the claims of scheduler jobs that are still firing from going stale, so that they are
+    not fired again while their trigger runs.
+    """
+    mongo.db["scheduler_jobs"].update_many(
+        {"_id": {"$in": job_ids}, "status": SchedulerJobStatus.FIRING},
+        {"$set": {"claimed_at": time.time()}},
+    )
+
+
+def finish_scheduler_job(job_id, succeeded):
+    mongo.db["scheduler_jobs"].update_one(
+        {"_id": job_id, "status": SchedulerJobStatus.FIRING},
+        {
+            "$set": {
+                "status": (
+                    SchedulerJobStatus.FIRED if succeeded else SchedulerJobStatus.FAILED
+                )
+            }
+        },
+    )
+
+
+def get_jenkins_run_status_counts(cid, rid, netids=None):
+    """
+    Count the jobs of a run by status, across all of the builds of the run.
+    :param netids: the students whose jobs are counted, or None for all of them.
+    :return: a dict mapping statuses to numbers of jobs.
+    """
+    query = {"cid": cid, "rid": rid}
+    if netids is not None:
+        query["netid"] = {"$in": netids}
+    docs = mongo.db["jenkins_run_status"].aggregate(
+        [
+            {"$match": query},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        ]
+    )
+    return {doc["_id"]: doc["count"] for doc in docs}
+
+
 def get_course_grades(cid):
     try:
         response = mongo.db["new_gv_assignments"].find(
-            {"courseId": cid}, {"_id": 0, "__v": 0, "courseId": 0}
+            {"courseId": cid}, {"__v": 0, "courseId": 0}
         ).sort({"dueDate": -1})
         return list(response)
     except Exception as e:
         print(e, flush=True)
         return []
     
+def _score_as_double(score):
+    return {"$convert": {"input": score, "to": "double", "onError": 0, "onNull": 0}}
+
+
+def get_course_grades_version(cid):
+    """
+    Compute a version of the grades of a course that changes whenever an assignment is added,
+    removed or edited, or the statistics of its scores may change. The sorted scores of each
+    assignment are hashed on the server, so only one number per assignment is transferred.
+    :return: a hex digest, or None if the server does not support the pipeline.
+    """
+    scores = {
+        "$map": {"input": "$data", "as": "s", "in": _score_as_double("$$s.score")}
+    }
+    try:
+        fingerprints = list(
+            mongo.db["new_gv_assignments"].aggregate(
+                [
+                    {"$match": {"courseId": cid}},
+                    {
+                        "$project": {
+                            "name": 1,
+                            "type": 1,
+                            "dueDate": 1,
+                            "__v": 1,
+                            "scores": {
+                                "$toHashedIndexKey": {
+                                    "$sortArray": {"input": scores, "sortBy": 1}
+                                }
+                            },
+                        }
+                    },
+                    {"$sort": {"_id": 1}},
+                ]
+            )
+        )
+    except OperationFailure as e:
+        logger.warning("Failed to compute the grades version of %s: %s", cid, e)
+        return None
+    digest = hashlib.sha256()
+    for fingerprint in fingerprints:
+        digest.update(repr(sorted(fingerprint.items())).encode())
+    return digest.hexdigest()
+
+
+def get_grade_statistics(cid):
+    """
+    :return: the stored statistics of a course's grades, as a document with version and
+        assignments keys, or None if none were stored.
+    """
+    return mongo.db["grade_statistics"].find_one({"_id": cid})
+
+
+def set_grade_statistics(cid, version, assignments):
+    mongo.db["grade_statistics"].replace_one(
+        {"_id": cid},
+        {"version": version, "assignments": assignments},
+        upsert=True,
+    )
+
+
+def _score_bin(score):
+    """
+    The histogram bin of a score, as in util.bin_scores. Python floors the quotient of the
+    score and the bin width from the remainder rather than from the rounded quotient, which can
+    differ by one at bin edges, so the same computation is done here.
+    """
+    width = util.SCORE_BIN_WIDTH
+    count = util.SCORE_BIN_COUNT
+    return {
+        "$let": {
+            "vars": {"mod": {"$mod": [score, width]}},
+            "in": {
+                "$let": {
+                    "vars": {
+                        "idx": {
+                            "$min": [
+                                {
+                                    "$round": {
+                                        "$subtract": [
+                                            {
+                                                "$divide": [
+                                                    {"$subtract": [score, "$$mod"]},
+                                                    width,
+                                                ]
+                                            },
+                                            {"$cond": [{"$lt": ["$$mod", 0]}, 1, 0]},
+                                        ]
+                                    }
+                                },
+                                count - 1,
+                            ]
+                        }
+                    },
+                    # negative indices count from the last bin
+                    "in": {
+                        "$cond": [
+                            {"$lt": ["$$idx", 0]},
+                            {"$add": ["$$idx", count]},
+                            "$$idx",
+                        ]
+                    },
+                }
+            },
+        }
+    }
+
+
+def _sum_left_to_right(values):
+    # $sum adds with extra precision; util.compute_statistics adds in plain double arithmetic
+    return {
+        "$reduce": {
+            "input": values,
+            "initialValue": 0,
+            "in": {"$add": ["$$value", "$$this"]},
+        }
+    }
+
+
+def _half(value):
+    # integer division by two, like // in util._quartile_indices
+    return {"$floor": {"$divide": [value, 2]}}
+
+
+def summarize_course_grades(cid, netid=None):
+    """
+    Compute the statistics and score histogram of every graded assignment of a course on the
+    server, so that the scores of the class are never transferred. The order statistics are
+    picked from the sorted scores and the sums are taken left to right, so that once rounded
+    with util.summary_statistics, the results equal those of util.compute_statistics and
+    util.bin_scores.
+    :param cid: a course ID.
+    :param netid: a student whose raw score of each assignment is also returned, if given.
+    :return: a list of documents with _id, name, type, n, min, q1, median, q3, max, mean, std,
+        bins (a list of counts) and score, newest assignment first.
+    :raises OperationFailure: if the server does not support the pipeline.
+    """
+    scores = {
+        "$map": {"input": "$data", "as": "s", "in": _score_as_double("$$s.score")}
+    }
+    student = {
+        "$first": {
+            "$filter": {"input": "$data", "cond": {"$eq": ["$$this.netid", netid]}}
+        }
+    }
+    squared_diffs = {
+        "$map": {
+            "input": "$scores",
+            "in": {
+                "$let": {
+                    "vars": {"diff": {"$subtract": ["$$this", "$mean"]}},
+                    "in": {"$multiply": ["$$diff", "$$diff"]},
+                }
+            },
+        }
+    }
+    bins = {
+        "$map": {
+            "input": {"$range": [0, util.SCORE_BIN_COUNT]},
+            "as": "bin",
+            "in": {
+                "$size": {
+                    "$filter": {
+                        "input": "$bin_idx",
+                        "cond": {"$eq": ["$$this", "$$bin"]},
+                    }
+                }
+            },
+        }
+    }
+    return list(
+        mongo.db["new_gv_assignments"].aggregate(
+            [
+                {"$match": {"courseId": cid}},
+                {"$sort": {"dueDate": -1}},
+                {
+                    "$project": {
+                        "name": 1,
+                        "type": 1,
+                        "scores": scores,
+                        "score": {"$ifNull": [student, {}]},
+                    }
+                },
+                {
+                    "$set": {
+                        "n": {"$size": "$scores"},
+                        "sorted": {"$sortArray": {"input": "$scores", "sortBy": 1}},
+                        "total": _sum_left_to_right("$scores"),
+                        "score": "$score.score",
+                    }
+                },
+                {
+                    "$set": {
+                        # assignments without scores get zero statistics
+                        "mean": {"$divide": ["$total", {"$max": ["$n", 1]}]},
+                        # the indices of util._quartile_indices
+                        "median_idx": _half({"$subtract": ["$n", 1]}),
+                        "bin_idx": {
+                            "$map": {"input": "$scores", "in": _score_bin("$$this")}
+                        },
+                    }
+                },
+                {
+                    "$project": {
+                        "name": 1,
+                        "type": 1,
+                        "n": 1,
+                        "score": 1,
+                        "mean": 1,
+                        "min": {"$first": "$sorted"},
+                        "q1": {"$arrayElemAt": ["$sorted", _half("$median_idx")]},
+                        "median": {"$arrayElemAt": ["$sorted", "$median_idx"]},
+                        "q3": {
+                            "$arrayElemAt": [
+                                "$sorted",
+                                {
+                                    "$add": [
+                                        "$median_idx",
+                                        _half({"$subtract": ["$n", "$median_idx"]}),
+                                    ]
+                                },
+                            ]
+                        },
+                        "max": {"$last": "$sorted"},
+                        "std": {
+                            "$sqrt": {
+                                "$divide": [
+                                    _sum_left_to_right(squared_diffs),
+                                    {"$max": ["$n", 1]},
+                                ]
+                            }
+                        },
+                        "bins": bins,
+                    }
+                },
+            ]
+        )
+    )
+
+
+def get_student_grade_scores(cid, netid):
+    """
+    Fetch a student's score of every graded assignment of a course, without the scores of the
+    other students.
+    :return: a dict mapping assignment document IDs, as strings, to raw scores.
+    """
+    docs = mongo.db["new_gv_assignments"].aggregate(
+        [
+            {"$match": {"courseId": cid}},
+            {
+                "$project": {
+                    "score": {
+                        "$first": {
+                            "$filter": {
+                                "input": "$data",
+                                "cond": {"$eq": ["$$this.netid", netid]},
+                            }
+                        }
+                    }
+                }
+            },
+        ]
+    )
+    return {str(doc["_id"]): doc["score"]["score"] for doc in docs if doc.get("score")}
+
+
 def get_user_requested_extensions(cid, netid):
     try:
         response = mongo.db["extensions"].find(
             {"course_id": cid, "netid": netid, "userRequested": True}, {"_id": 0, "__v": 0, "courseId": 0}
         ).sort({"dueDate": -1})
-        course_data = mongo.db["courses"].find_one({"_id": cid}, {"_id": 0, "num_student_extensions": 1, "num_ext_hours": 1, "last_assignment_due_date": 1})
+        course_data = get_course(cid)
         allowed_extensions = 0
         num_ext_hours = 0
         last_assignment_due_date = 0
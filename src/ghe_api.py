@@ -1,18 +1,58 @@
 import logging
+import threading
+import time
 import requests
 from http import HTTPStatus
 from datetime import datetime as dt
 
+import config
 from config import GHE_API_URL, TZ
+from src import http_client
+from src.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
 ACCEPT_JSON = {"Accept": "application/json"}
 
+# The latest commit of each student repo is reused for GHE_COMMIT_CACHE_TTL seconds, then
+# revalidated with its ETag, so that an unchanged repo costs a 304 response, which does not
+# count against the rate limit. When less than half of a token's rate limit is left, the TTL
+# grows in proportion, up to GHE_COMMIT_CACHE_MAX_TTL seconds.
+GHE_COMMIT_CACHE_TTL = getattr(config, "GHE_COMMIT_CACHE_TTL", 15)
+GHE_COMMIT_CACHE_MAX_TTL = getattr(config, "GHE_COMMIT_CACHE_MAX_TTL", 600)
+GHE_COMMIT_CACHE_SIZE = 4096
+# entries outlive their TTL so that stale ones can still be revalidated
+GHE_COMMIT_CACHE_RETENTION = 24 * 3600
+
+_commits = TTLCache(GHE_COMMIT_CACHE_SIZE, GHE_COMMIT_CACHE_RETENTION)
+# access token -> (remaining, limit) as last reported by GitHub
+_rate_limits = {}
+_not_modified = 0
+_lock = threading.Lock()
+
+
+def _track_rate_limit(access_token, response):
+    try:
+        remaining = int(response.headers["X-RateLimit-Remaining"])
+        limit = int(response.headers["X-RateLimit-Limit"])
+    except (KeyError, ValueError):
+        return
+    with _lock:
+        _rate_limits[access_token] = (remaining, limit)
+
+
+def _commit_cache_ttl(access_token):
+    with _lock:
+        remaining, limit = _rate_limits.get(access_token, (None, None))
+    if not limit or remaining * 2 >= limit:
+        return GHE_COMMIT_CACHE_TTL
+    ttl = GHE_COMMIT_CACHE_TTL * limit / (2 * max(remaining, 1))
+    return min(ttl, GHE_COMMIT_CACHE_MAX_TTL)
+
 
 def get_login(access_token):
     try:
-        resp = requests.get(
+        resp = http_client.get(
             "%s/user" % GHE_API_URL,
             headers={"Authorization": "token {}".format(access_token)},
         )
@@ -24,20 +64,34 @@ def get_login(access_token):
 
 
 def get_latest_commit(netid, access_token, github_org, github_repo_prefix):
+    global _not_modified
     latest_commit = {"message": "An error occurred", "sha": "", "url": ""}
 
-    # retrieve all student repo commits
     commits_url = (
         f"{GHE_API_URL}/repos/{github_org}/{github_repo_prefix}_{netid}/commits"
     )
-    commits_url += "?until=" + dt.now(tz=TZ).isoformat()
+    cached = _commits.get(commits_url)
+    now = time.monotonic()
+    ttl = _commit_cache_ttl(access_token)
+    if cached is not None and now - cached["checked_at"] < ttl:
+        return dict(cached["commit"])
+
+    # retrieve the latest student repo commit
+    headers = {"Authorization": "token {}".format(access_token)}
+    if cached is not None:
+        headers["If-None-Match"] = cached["etag"]
+    params = {"until": dt.now(tz=TZ).isoformat(), "per_page": 1}
     try:
-        response = requests.get(
-            commits_url, headers={"Authorization": "token {}".format(access_token)}
-        )
+        response = http_client.get(commits_url, headers=headers, params=params)
     except requests.exceptions.RequestException as ex:
         logger.error("Failed to fetch student commits\n{}".format(str(ex)))
-        return latest_commit
+        return dict(cached["commit"]) if cached is not None else latest_commit
+    _track_rate_limit(access_token, response)
+    if response.status_code == HTTPStatus.NOT_MODIFIED and cached is not None:
+        with _lock:
+            _not_modified += 1
+        _commits.set(commits_url, {**cached, "checked_at": now})
+        return dict(cached["commit"])
     if (
         response.status_code == HTTPStatus.NOT_FOUND
         or response.status_code == HTTPStatus.CONFLICT
@@ -57,4 +111,20 @@ def get_latest_commit(netid, access_token, github_org, github_repo_prefix):
         latest_commit["message"] = latest_raw_commit["commit"]["message"]
         latest_commit["sha"] = latest_raw_commit["sha"]
         latest_commit["url"] = latest_raw_commit["html_url"]
+    etag = response.headers.get("ETag")
+    if etag:
+        _commits.set(
+            commits_url,
+            {"etag": etag, "commit": dict(latest_commit), "checked_at": now},
+        )
     return latest_commit
+
+
+def cache_stats():
+    with _lock:
+        remaining = [remaining for remaining, _ in _rate_limits.values()]
+        return {
+            "commits": _commits.stats(),
+            "not_modified": _not_modified,
+            "lowest_rate_limit_remaining": min(remaining) if remaining else None,
+        }
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Outbound HTTP requests to Jenkins, the scheduler and GitHub share one keep-alive session per
+# host. HTTP_POOL_SIZE bounds the connections kept open to each host and should cover the
+# number of threads of a worker. Idempotent requests that fail to connect, time out while
+# reading, or get a 502, 503 or 504 are retried up to HTTP_RETRIES times with jittered backoff.
+HTTP_CONNECT_TIMEOUT = getattr(config, "HTTP_CONNECT_TIMEOUT", 3.05)
+HTTP_READ_TIMEOUT = getattr(config, "HTTP_READ_TIMEOUT", 10)
+HTTP_RETRIES = getattr(config, "HTTP_RETRIES", 2)
+HTTP_POOL_SIZE = getattr(config, "HTTP_POOL_SIZE", 32)
+HTTP_RETRY_BACKOFF = 0.2
+
+_sessions = {}
+_metrics = {}
+_lock = threading.Lock()
+
+
+class HostMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, elapsed, failed):
+        self.requests += 1
+        self.errors += failed
+        self.seconds += elapsed
+        self.max_seconds = max(self.max_seconds, elapsed)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "mean_ms": (
+                round(self.seconds / self.requests * 1000, 3) if self.requests else 0
+            ),
+            "max_ms": round(self.max_seconds * 1000, 3),
+        }
+
+
+def _new_session():
+    retry = Retry(
+        total=HTTP_RETRIES,
+        # Retry only retries the methods in Retry.DEFAULT_ALLOWED_METHODS, which are idempotent
+        status_forcelist=(502, 503, 504),
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        backoff_jitter=HTTP_RETRY_BACKOFF,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _session(host):
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _new_session()
+            _metrics[host] = HostMetrics()
+        return session
+
+
+def request(method, url, **kwargs):
+    """
+    Send a request through the pooled session of the URL's host. Takes the same arguments as
+    requests.request, and uses (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT) if no timeout is given.
+    :return: a requests.Response.
+    :raises requests.exceptions.RequestException: if the request could not be completed.
+    """
+    host = urlsplit(url).netloc
+    session = _session(host)
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    start = time.monotonic()
+    failed = True
+    try:
+        resp = session.request(method, url, **kwargs)
+        failed = resp.status_code >= 500
+        return resp
+    finally:
+        elapsed = time.monotonic() - start
+        with _lock:
+            _metrics[host].record(elapsed, failed)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
+
+
+def stats():
+    with _lock:
+        return {host: metrics.stats() for host, metrics in _metrics.items()}
@@ -1,32 +1,122 @@
-import requests
+import codecs
+import logging
+import math
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
 
+import config
 from config import JENKINS_API_URL
-from src import db
+from src import db, http_client
+from src.cache import TTLCache
+from src.log_cache import LogCache
+from src.sched_api import ScheduledRunStatus
 from src.util import timestamp_to_bw_api_format, catch_request_errors
 from uuid import uuid4
+from ansi2html import Ansi2HTMLConverter
+from pymongo.errors import PyMongoError
+from requests.exceptions import RequestException
+
+logger = logging.getLogger(__name__)
 
 STUDENT_ID = "STUDENT_ID"
 
+# Jenkins authorization headers by course ID, so that Jenkins calls need no course lookup.
+# Entries are dropped when the course changes or Jenkins rejects them; the TTL only bounds
+# staleness when course changes are not observed.
+JENKINS_HEADER_TTL = getattr(config, "JENKINS_HEADER_TTL", 3600)
 
-def build_header(cid):
-    token = db.get_course(cid)["token"]
+_headers = TTLCache(db.COURSE_CACHE_SIZE, JENKINS_HEADER_TTL)
+
+
+def _forget_header(cid):
+    if cid is None:
+        _headers.clear()
+    else:
+        _headers.pop(cid)
+
+
+db.add_course_listener(_forget_header)
+
+# Logs of finished jobs are kept on disk under LOG_CACHE_DIR, up to LOG_CACHE_MAX_MB megabytes;
+# a LOG_CACHE_DIR of None disables the cache. The Blue Ocean nodes of recently viewed builds
+# are kept in memory, so that the logs of other students in a build need no node listing.
+LOG_CACHE_DIR = getattr(
+    config, "LOG_CACHE_DIR", os.path.join(tempfile.gettempdir(), "on-demand-logs")
+)
+LOG_CACHE_MAX_MB = getattr(config, "LOG_CACHE_MAX_MB", 512)
+BUILD_NODES_CACHE_SIZE = 128
+BUILD_NODES_CACHE_TTL = 3600
+LOG_CHUNK_BYTES = 64 * 1024
+
+# Worker status snapshots, keyed by Jenkins URL, and the only fields get_workers reads from
+# Jenkins
+JENKINS_WORKERS_TTL = getattr(config, "JENKINS_WORKERS_TTL", 5)
+WORKERS_TREE = (
+    "computer[displayName,offline,temporarilyOffline,idle,"
+    "monitorData[hudson.node_monitors.ResponseTimeMonitor[average]]]"
+)
+
+_workers = TTLCache(1, JENKINS_WORKERS_TTL)
+
+# With SCHEDULED_RUN_SHARDING, the roster of a scheduled run is split across several builds of
+# the same grading run: one per SCHEDULED_RUN_SHARD_SIZE students, or, if that is None, one
+# per live Jenkins worker, but never more than SCHEDULED_RUN_MAX_SHARDS. The builds are
+# triggered concurrently, at most SCHEDULED_RUN_TRIGGER_WORKERS at a time per worker process.
+SCHEDULED_RUN_SHARDING = getattr(config, "SCHEDULED_RUN_SHARDING", False)
+SCHEDULED_RUN_SHARD_SIZE = getattr(config, "SCHEDULED_RUN_SHARD_SIZE", None)
+SCHEDULED_RUN_MAX_SHARDS = getattr(config, "SCHEDULED_RUN_MAX_SHARDS", 32)
+SCHEDULED_RUN_TRIGGER_WORKERS = getattr(config, "SCHEDULED_RUN_TRIGGER_WORKERS", 8)
+
+_trigger_executor = ThreadPoolExecutor(
+    SCHEDULED_RUN_TRIGGER_WORKERS, thread_name_prefix="jenkins-trigger"
+)
+
+_log_cache = (
+    LogCache(LOG_CACHE_DIR, LOG_CACHE_MAX_MB * 1024 * 1024) if LOG_CACHE_DIR else None
+)
+_build_nodes = TTLCache(BUILD_NODES_CACHE_SIZE, BUILD_NODES_CACHE_TTL)
+
+
+def _make_header(token):
     return {"Authorization": f"Basic {token}", "Content-Type": "application/json"}
 
 
-@catch_request_errors
-def start_grading_run(cid, aid, netids, timestamp, publish, grading_run_id: str | None):
+def build_header(cid):
     """
-    Attempt to start a grading run.
-    :param cid: the course ID.
-    :param aid: the assignment ID within the course.
-    :param netid: an arary of student NetIDs.
-    :param timestamp: the UNIX timestamp for the run due date.
-    :param publish: whether this run should be published to the grade viewer
-    :param grading_run_id: grading run ID to use (optional)
-    :return: a run_id string if successful, or None otherwise.
+    Get the headers authorizing Jenkins requests for a course. The result is cached and shared,
+    so callers must not mutate it.
+    """
+    return _headers.get_or_load(cid, lambda: _make_header(db.get_course(cid)["token"]))
+
+
+def prebuild_headers():
+    """
+    Fill the header cache for every course with one query, e.g. when a worker starts. Failures
+    are logged, and headers are then built on first use instead.
+    """
+    try:
+        for course in db.get_course_tokens():
+            _headers.set(course["_id"], _make_header(course["token"]))
+    except PyMongoError as e:
+        logger.warning("Failed to prebuild Jenkins headers: %s", e)
+
+
+def _jenkins_request(method, cid, url, **kwargs):
+    resp = http_client.request(method, url, headers=build_header(cid), **kwargs)
+    if resp.status_code in (HTTPStatus.UNAUTHORIZED, HTTPStatus.FORBIDDEN):
+        # the course token may have changed since the header was cached
+        _headers.pop(cid)
+    return resp
+
+
+def _trigger_build(cid, aid, netids, timestamp, publish, grading_run_id):
+    """
+    Queue a build of an assignment's job for some students.
+    :return: the response of Jenkins, whose Location header is the URL of the queue item.
+    :raises requests.exceptions.RequestException: if the build could not be queued.
     """
-    if not grading_run_id:
-        grading_run_id = str(uuid4())
     due_date_str = timestamp_to_bw_api_format(timestamp)
     payload = {
         "STUDENT_IDS": ",".join(netids),
@@ -36,37 +126,235 @@ def start_grading_run(cid, aid, netids, timestamp, publish, grading_run_id: str
         "PUBLISH_FINAL_GRADE": "true" if publish else "false",
         "GRADING_RUN_ID": grading_run_id,
     }
-    resp = requests.post(
-        url=f"{JENKINS_API_URL}/job/{aid}/buildWithParameters",
-        headers=build_header(cid),
+    resp = _jenkins_request(
+        "POST",
+        cid,
+        f"{JENKINS_API_URL}/job/{aid}/buildWithParameters",
         params=payload,
     )
     resp.raise_for_status()
+    return resp
+
+
+@catch_request_errors
+def start_grading_run(cid, aid, netids, timestamp, publish, grading_run_id: str | None):
+    """
+    Attempt to start a grading run.
+    :param cid: the course ID.
+    :param aid: the assignment ID within the course.
+    :param netid: an arary of student NetIDs.
+    :param timestamp: the UNIX timestamp for the run due date.
+    :param publish: whether this run should be published to the grade viewer
+    :param grading_run_id: grading run ID to use (optional)
+    :return: a run_id string if successful, or None otherwise.
+    """
+    if not grading_run_id:
+        grading_run_id = str(uuid4())
+    _trigger_build(cid, aid, netids, timestamp, publish, grading_run_id)
     return grading_run_id
 
 
+def shard_roster(cid, netids):
+    """
+    Split a roster into the rosters of the builds of a sharded run, of nearly equal sizes and
+    in roster order. Without a configured shard size, there is one shard per live worker, or
+    a single shard if the workers cannot be listed.
+    """
+    if not netids:
+        return []
+    if SCHEDULED_RUN_SHARD_SIZE:
+        num_shards = math.ceil(len(netids) / SCHEDULED_RUN_SHARD_SIZE)
+    else:
+        try:
+            num_shards = sum(worker["alive"] for worker in get_workers(cid)) or 1
+        except (RequestException, KeyError) as e:
+            logger.warning("Failed to list workers to shard a run of %s: %r", cid, e)
+            num_shards = 1
+    num_shards = max(min(num_shards, SCHEDULED_RUN_MAX_SHARDS, len(netids)), 1)
+    return [
+        netids[i * len(netids) // num_shards : (i + 1) * len(netids) // num_shards]
+        for i in range(num_shards)
+    ]
+
+
+def _start_shard(cid, aid, netids, timestamp, publish, grading_run_id):
+    shard = {"roster": netids, "queue_item": None}
+    try:
+        resp = _trigger_build(cid, aid, netids, timestamp, publish, grading_run_id)
+    except RequestException as e:
+        logger.error(
+            "Failed to trigger a build of %s/%s for %d students: %r",
+            cid,
+            aid,
+            len(netids),
+            e,
+        )
+        shard["status"] = ScheduledRunStatus.FAILED
+    else:
+        shard["queue_item"] = resp.headers.get("Location")
+        shard["status"] = ScheduledRunStatus.RAN
+    return shard
+
+
+def start_sharded_grading_run(
+    cid, aid, netids, timestamp, publish, grading_run_id: str | None = None
+):
+    """
+    Start a grading run whose roster is split across several builds, see shard_roster. All the
+    builds report their jobs under the same grading run ID, so the statuses of the run's jobs
+    are tracked as for a single build.
+    :param grading_run_id: grading run ID to use (optional)
+    :return: a (run_id, shards) tuple, where shards lists a dict per build, with its roster, the
+        URL of its Jenkins queue item and its scheduled run status: RAN if it was queued, or
+        FAILED.
+    """
+    if not grading_run_id:
+        grading_run_id = str(uuid4())
+    futures = [
+        _trigger_executor.submit(
+            _start_shard, cid, aid, roster, timestamp, publish, grading_run_id
+        )
+        for roster in shard_roster(cid, netids)
+    ]
+    return grading_run_id, [future.result() for future in futures]
+
+
 @catch_request_errors
 def get_grading_run_details(cid, rid):
     return db.get_jenkins_run_status_all(cid, rid)
 
 
-def get_grading_run_log(cid, aid, build_url, netid):
-    splitted = [x for x in build_url.split("/") if x != ""]
-    build_id = splitted[-1]
-    url = f"{JENKINS_API_URL}/blue/rest/organizations/jenkins/pipelines/{aid}/runs/{build_id}/nodes/"
-    resp = requests.get(url=url, headers=build_header(cid))
-    data = resp.json()
-    for entry in data:
-        if entry["displayName"].startswith(netid):
-            link = f"{JENKINS_API_URL}{entry['_links']['self']['href']}log"
-            raw = requests.get(url=link, headers=build_header(cid))
-            return raw.text
+def _find_node(nodes, netid):
+    for display_name, href in nodes:
+        if display_name.startswith(netid):
+            return href
+    return None
+
+
+def _get_log_url(cid, aid, build_url, netid):
+    """
+    Find the URL of a student's job log in a build. The build's nodes are listed once and
+    cached; they are listed again if the student is not among the cached nodes.
+    """
+    nodes = _build_nodes.get(build_url)
+    href = _find_node(nodes, netid) if nodes is not None else None
+    if href is None:
+        splitted = [x for x in build_url.split("/") if x != ""]
+        build_id = splitted[-1]
+        url = f"{JENKINS_API_URL}/blue/rest/organizations/jenkins/pipelines/{aid}/runs/{build_id}/nodes/"
+        resp = _jenkins_request("GET", cid, url)
+        nodes = [
+            (entry["displayName"], entry["_links"]["self"]["href"])
+            for entry in resp.json()
+        ]
+        _build_nodes.set(build_url, nodes)
+        href = _find_node(nodes, netid)
+    return f"{JENKINS_API_URL}{href}log" if href is not None else None
+
+
+def get_grading_run_log(cid, aid, build_url, netid, finished=False):
+    """
+    Get the log of a student's job in a build.
+    :param finished: whether the job has finished, so that its log can no longer change. Only
+        the logs of finished jobs are read from and stored in the log cache.
+    :return: the log, or None if the build has no job for the student.
+    """
+    if finished and _log_cache is not None:
+        text = _log_cache.get(build_url, netid)
+        if text is not None:
+            return text
+    link = _get_log_url(cid, aid, build_url, netid)
+    if link is None:
+        return None
+    raw = _jenkins_request("GET", cid, link)
+    # a job that is reported finished may still be writing its log, which Jenkins signals with
+    # X-More-Data on progressive text requests
+    more_data = raw.headers.get("X-More-Data", "").lower() == "true"
+    if finished and raw.ok and not more_data and _log_cache is not None:
+        _log_cache.set(build_url, netid, raw.text)
+    return raw.text
+
+
+def stream_grading_run_log(cid, aid, build_url, netid, start=0, finished=False):
+    """
+    Get the part of a student's job log after a byte offset, using Jenkins' progressive text
+    protocol, without reading it into memory. Finished logs are served from the log cache.
+    :param start: the byte offset to start from, i.e. the text size returned by the previous
+        call, or 0 for the whole log.
+    :param finished: whether the job has finished, so that its log can no longer change.
+    :return: a (chunks, text_size, more_data) tuple, where chunks is an iterator of bytes,
+        text_size is the offset to continue from and more_data tells whether the log may still
+        grow; or None if the build has no job for the student.
+    :raises requests.exceptions.RequestException: if Jenkins could not be reached.
+    """
+    if finished and _log_cache is not None:
+        text = get_grading_run_log(cid, aid, build_url, netid, finished=True)
+        if text is None:
+            return None
+        data = text.encode("utf-8")
+        return iter([data[start:]]), len(data), False
+    link = _get_log_url(cid, aid, build_url, netid)
+    if link is None:
+        return None
+    resp = _jenkins_request("GET", cid, link, params={"start": start}, stream=True)
+    resp.raise_for_status()
+    if "X-Text-Size" not in resp.headers:
+        data = resp.content
+        return iter([data]), start + len(data), False
+    more_data = resp.headers.get("X-More-Data", "").lower() == "true"
+
+    def chunks():
+        with resp:
+            yield from resp.iter_content(LOG_CHUNK_BYTES)
+
+    return chunks(), int(resp.headers["X-Text-Size"]), more_data
+
+
+def iter_log_text(chunks, as_html=False):
+    """
+    Decode the chunks of a log into text, split at line ends so that no character or ANSI
+    escape sequence is cut in half.
+    :param as_html: whether to convert the text to HTML, turning ANSI colors into styles. Each
+        piece is converted separately, so a color that spans pieces is not carried over.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    converter = Ansi2HTMLConverter(inline=True) if as_html else None
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        end = pending.rfind("\n") + 1
+        if end:
+            text, pending = pending[:end], pending[end:]
+            yield converter.convert(text, full=False) if converter else text
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield converter.convert(pending, full=False) if converter else pending
+
+
+def log_cache_stats():
+    return {
+        "logs": _log_cache.stats() if _log_cache is not None else None,
+        "build_nodes": _build_nodes.stats(),
+        "workers": _workers.stats(),
+    }
 
 
 def get_workers(cid):
+    """
+    Get the status of the Jenkins workers. All courses use the same Jenkins, so they share one
+    snapshot, refreshed by a single request at a time once it is JENKINS_WORKERS_TTL seconds
+    old. The result is shared, so callers must not mutate it.
+    """
+    return _workers.get_or_load(
+        JENKINS_API_URL, lambda: _fetch_workers(cid), single_flight=True
+    )
+
+
+def _fetch_workers(cid):
     hosts = []
     url = f"{JENKINS_API_URL}/computer/api/json"
-    resp = requests.get(url=url, headers=build_header(cid))
+    resp = _jenkins_request("GET", cid, url, params={"tree": WORKERS_TREE})
+    resp.raise_for_status()
     data = resp.json()
     for item in data["computer"]:
         if item["displayName"] == "Built-In Node":
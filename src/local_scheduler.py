@@ -0,0 +1,258 @@
+import atexit
+import heapq
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from pymongo.errors import PyMongoError
+
+import config
+from src import db
+
+logger = logging.getLogger(__name__)
+
+# The local scheduler keeps scheduler jobs in the scheduler_jobs collection. One process, the
+# holder of a lease renewed every SCHEDULER_POLL_SECONDS and lost after SCHEDULER_LEASE_SECONDS
+# without renewal, fires them, at most SCHEDULER_TRIGGER_WORKERS at a time. Jobs scheduled by
+# other processes are picked up by the leader within SCHEDULER_POLL_SECONDS.
+SCHEDULER_POLL_SECONDS = getattr(config, "SCHEDULER_POLL_SECONDS", 5)
+SCHEDULER_LEASE_SECONDS = getattr(config, "SCHEDULER_LEASE_SECONDS", 30)
+SCHEDULER_TRIGGER_WORKERS = getattr(config, "SCHEDULER_TRIGGER_WORKERS", 4)
+
+_scheduler = None
+
+
+class LocalScheduler:
+    """
+    Fires the scheduler jobs stored in the database when they are due. Every process runs one,
+    but only the process holding the scheduler lease fires jobs: it keeps the jobs due before
+    its next poll in a min-heap ordered by time, and sleeps until the earliest one is due. Jobs
+    that were due while no process was leading, e.g. during a restart, are fired by the next
+    leader as soon as it takes over.
+    """
+
+    def __init__(self, trigger, poll_seconds, lease_seconds, workers):
+        """
+        :param trigger: a function taking the course ID, assignment ID and ID of a job that is
+            due, which starts its scheduled runs and returns the number of errors.
+        :param poll_seconds: the interval at which the lease is renewed and due jobs are read.
+        :param lease_seconds: how long the lease is held without renewal. The claim of a job
+            that is firing is renewed along with the lease; a job whose claim was not renewed
+            within this time, e.g. because the process firing it died, is fired again.
+        :param workers: the maximum number of jobs fired concurrently.
+        """
+        self._trigger = trigger
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(
+            workers, thread_name_prefix="scheduler-trigger"
+        )
+        # (time, job ID) entries, and the latest time pushed for each job; entries whose time
+        # is no longer the job's are stale and skipped when their job is claimed
+        self._heap = []
+        self._queued = {}
+        # IDs of the jobs claimed by this process whose trigger has not returned
+        self._firing = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.is_leader = False
+        self.fired = 0
+        self.failed = 0
+        self.max_lag_seconds = 0.0
+
+    def add(self, job_id, run_time):
+        """
+        Queue a job that was just scheduled or moved in this process, if this process leads.
+        Jobs due after the next poll are left for it.
+        """
+        with self._lock:
+            if not self.is_leader or run_time > time.time() + self.poll_seconds:
+                return
+            self._push(job_id, run_time)
+        self._wakeup.set()
+
+    def _push(self, job_id, run_time):
+        if self._queued.get(job_id) != run_time:
+            self._queued[job_id] = run_time
+            heapq.heappush(self._heap, (run_time, job_id))
+
+    def _poll(self, now):
+        with self._lock:
+            firing = list(self._firing)
+        try:
+            # renewed even without the lease, since the triggers keep running
+            if firing:
+                db.renew_scheduler_job_claims(firing)
+            leader = db.acquire_scheduler_lease(self.owner, self.lease_seconds)
+            jobs = []
+            if leader:
+                jobs = db.get_due_scheduler_jobs(
+                    now + self.poll_seconds, now - self.lease_seconds
+                )
+        except PyMongoError as e:
+            logger.warning("Failed to poll scheduler jobs: %s", e)
+            leader, jobs = False, []
+        with self._lock:
+            if leader != self.is_leader:
+                logger.info(
+                    "%s %s the scheduler lease",
+                    self.owner,
+                    "acquired" if leader else "lost",
+                )
+                self.is_leader = leader
+            if not leader:
+                self._heap, self._queued = [], {}
+            for job in jobs:
+                self._push(job["_id"], job["time"])
+
+    def _fire_due(self, now):
+        while True:
+            with self._lock:
+                if not self.is_leader or not self._heap or self._heap[0][0] > now:
+                    return
+                run_time, job_id = heapq.heappop(self._heap)
+                if self._queued.get(job_id) == run_time:
+                    del self._queued[job_id]
+            self._executor.submit(self._fire, job_id, run_time)
+
+    def _fire(self, job_id, run_time):
+        try:
+            job = db.claim_scheduler_job(
+                job_id, run_time, time.time() - self.lease_seconds
+            )
+        except PyMongoError as e:
+            logger.warning("Failed to claim scheduler job %s: %s", job_id, e)
+            return
+        if job is None:
+            # fired, deleted or moved meanwhile
+            return
+        lag = time.time() - run_time
+        with self._lock:
+            self._firing.add(job_id)
+        try:
+            errors = self._trigger(job["course_id"], job["assignment_id"], job_id)
+        except Exception:
+            logger.exception("Failed to fire scheduler job %s", job_id)
+            errors = 1
+        finally:
+            with self._lock:
+                self._firing.discard(job_id)
+        try:
+            db.finish_scheduler_job(job_id, errors == 0)
+        except PyMongoError as e:
+            # the job is fired again once its claim is stale
+            logger.warning("Failed to finish scheduler job %s: %s", job_id, e)
+        with self._lock:
+            self.fired += 1
+            self.failed += errors > 0
+            self.max_lag_seconds = max(self.max_lag_seconds, lag)
+
+    def _run(self):
+        next_poll = 0
+        while True:
+            # cleared first, so that jobs added from now on wake up the wait below
+            self._wakeup.clear()
+            now = time.time()
+            if now >= next_poll:
+                self._poll(now)
+                next_poll = now + self.poll_seconds
+            self._fire_due(time.time())
+            with self._lock:
+                next_due = self._heap[0][0] if self._heap else math.inf
+            self._wakeup.wait(max(min(next_due, next_poll) - time.time(), 0))
+
+    def _release(self):
+        with self._lock:
+            if not self.is_leader:
+                return
+            self.is_leader = False
+        try:
+            db.release_scheduler_lease(self.owner)
+        except PyMongoError as e:
+            logger.warning("Failed to release the scheduler lease: %s", e)
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="local-scheduler", daemon=True)
+        thread.start()
+        # let another process take over right away rather than after the lease expires
+        atexit.register(self._release)
+        return thread
+
+    def stats(self):
+        with self._lock:
+            return {
+                "leader": self.is_leader,
+                "queued": len(self._queued),
+                "firing": len(self._firing),
+                "fired": self.fired,
+                "failed": self.failed,
+                "max_lag_seconds": round(self.max_lag_seconds, 3),
+            }
+
+
+def start(trigger):
+    """
+    Start the local scheduler of this process.
+    :param trigger: see LocalScheduler.
+    """
+    global _scheduler
+    _scheduler = LocalScheduler(
+        trigger,
+        SCHEDULER_POLL_SECONDS,
+        SCHEDULER_LEASE_SECONDS,
+        SCHEDULER_TRIGGER_WORKERS,
+    )
+    _scheduler.start()
+
+
+def stats():
+    return _scheduler.stats() if _scheduler is not None else None
+
+
+def schedule_run(time, cid, aid):
+    """
+    Schedule a run at some time, see sched_api.schedule_run.
+    :return: scheduled run id, or None if an error occurs.
+    """
+    job_id = str(uuid4())
+    try:
+        db.add_scheduler_job(job_id, time, cid, aid)
+    except PyMongoError as e:
+        logger.error("Failed to schedule run of %s/%s: %s", cid, aid, e)
+        return None
+    if _scheduler is not None:
+        _scheduler.add(job_id, time)
+    return job_id
+
+
+def update_scheduled_run(scheduled_run_id, time):
+    """
+    Move a scheduled run to another time, see sched_api.update_scheduled_run.
+    :return: True if the update was successful, False otherwise.
+    """
+    try:
+        updated = db.update_scheduler_job(scheduled_run_id, time)
+    except PyMongoError as e:
+        logger.error("Failed to update scheduled run %s: %s", scheduled_run_id, e)
+        return False
+    if updated and _scheduler is not None:
+        _scheduler.add(scheduled_run_id, time)
+    return updated
+
+
+def delete_scheduled_run(scheduled_run_id):
+    """
+    Delete a scheduled run, see sched_api.delete_scheduled_run.
+    :return: True if the delete was successful, False otherwise.
+    """
+    try:
+        return db.delete_scheduler_job(scheduled_run_id)
+    except PyMongoError as e:
+        logger.error("Failed to delete scheduled run %s: %s", scheduled_run_id, e)
+        return False
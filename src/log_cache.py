@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class LogCache:
+    """
+    Job logs of finished builds, stored gzip-compressed in a directory shared by all workers.
+    The total size of the directory is bounded; when it is exceeded, the least recently read
+    logs are removed first. Files are replaced atomically, so concurrent workers never read a
+    partial log.
+    """
+
+    SUFFIX = ".log.gz"
+
+    def __init__(self, directory, max_bytes):
+        """
+        :param directory: the directory holding the logs; it is created if needed.
+        :param max_bytes: the maximum total size of the stored logs.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, build_url, netid):
+        key = hashlib.sha256(f"{build_url}\0{netid}".encode()).hexdigest()
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, build_url, netid):
+        """
+        :return: the cached log of a student's job in a build, or None if it is not cached.
+        """
+        path = self._path(build_url, netid)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                text = f.read()
+            # the modification time orders logs for eviction
+            os.utime(path)
+        except (OSError, EOFError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def set(self, build_url, netid, text):
+        path = self._path(build_url, netid)
+        data = gzip.compress(text.encode("utf-8"))
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Failed to cache log of %s in %s: %s", netid, build_url, e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(self.SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # evicted by another worker
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "files": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            }
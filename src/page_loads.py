@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Independent loads of a page run concurrently on a pool shared by all requests of a worker,
+# so that a page takes as long as its slowest load rather than the sum of all of them. Loads
+# from remote services, which may outlive the request, get a pool of their own so that a slow
+# service cannot hold up the database loads of every page.
+PAGE_LOAD_WORKERS = getattr(config, "PAGE_LOAD_WORKERS", 16)
+PAGE_LOAD_REMOTE_WORKERS = getattr(config, "PAGE_LOAD_REMOTE_WORKERS", 8)
+
+_executor = ThreadPoolExecutor(PAGE_LOAD_WORKERS, thread_name_prefix="page-load")
+_remote_executor = ThreadPoolExecutor(
+    PAGE_LOAD_REMOTE_WORKERS, thread_name_prefix="page-load-remote"
+)
+# stage name -> [count, total seconds, max seconds]
+_stage_stats = {}
+_lock = threading.Lock()
+
+
+class PageLoads:
+    """
+    The stages of loading one page. Each stage runs on the shared pool and its duration is
+    recorded, both for the Server-Timing header of the response and for stage_stats(). Stages
+    run without an app context, so they do not share the request memo of the db module.
+    """
+
+    def __init__(self):
+        # written by the pool threads while the request thread may read it
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, func, *args, **kwargs):
+        """
+        Start a stage.
+        :param name: the name of the stage, as shown in the Server-Timing header.
+        :return: a Future of the result of func(*args, **kwargs).
+        """
+        return self._submit(_executor, name, func, args, kwargs)
+
+    def submit_remote(self, name, func, *args, **kwargs):
+        """
+        Start a stage that calls a remote service, on the pool kept for them. Its result
+        should be waited for with a timeout.
+        :param name: the name of the stage, as shown in the Server-Timing header.
+        :return: a Future of the result of func(*args, **kwargs).
+        """
+        return self._submit(_remote_executor, name, func, args, kwargs)
+
+    def _submit(self, executor, name, func, args, kwargs):
+        def run():
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._record(name, time.monotonic() - start)
+
+        return executor.submit(run)
+
+    def _record(self, name, elapsed):
+        with self._lock:
+            self.durations[name] = elapsed
+        with _lock:
+            stats = _stage_stats.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def server_timing(self):
+        """
+        :return: the value of a Server-Timing header listing the stages that have finished.
+        """
+        with self._lock:
+            durations = list(self.durations.items())
+        return ", ".join(
+            "%s;dur=%.1f" % (name, elapsed * 1000) for name, elapsed in durations
+        )
+
+
+def stage_stats():
+    with _lock:
+        return {
+            name: {
+                "count": count,
+                "mean_ms": round(seconds / count * 1000, 3),
+                "max_ms": round(max_seconds * 1000, 3),
+            }
+            for name, (count, seconds, max_seconds) in _stage_stats.items()
+        }
@@ -45,8 +45,12 @@ def add_or_edit_scheduled_run(cid, aid, run_id, form, scheduled_run_id):
                     f"Invalid or non-existent student NetID: {student_netid}"
                 )
 
-    # Schedule a new run with scheduler
-    scheduled_run_id = sched_api.schedule_run(run_time, cid, aid)
+    # Runs with the same run time and due time share a scheduler job, and are started in
+    # one build when it fires. Otherwise, schedule a new run with scheduler
+    previous_scheduled_run_id = scheduled_run_id
+    scheduled_run_id = db.find_scheduler_job(cid, aid, run_time, due_time)
+    if scheduled_run_id is None:
+        scheduled_run_id = sched_api.schedule_run(run_time, cid, aid)
     if scheduled_run_id is None:
         return util.error("Failed to schedule run with scheduler")
     assert scheduled_run_id is not None
@@ -62,6 +66,13 @@ def add_or_edit_scheduled_run(cid, aid, run_id, form, scheduled_run_id):
         scheduled_run_id,
     ):
         return util.error("Failed to save the changes, please try again.")
+    # an edited run may leave a scheduler job that no other run uses
+    if (
+        previous_scheduled_run_id is not None
+        and previous_scheduled_run_id != scheduled_run_id
+        and db.find_referenced_scheduled_runs(previous_scheduled_run_id) == 0
+    ):
+        sched_api.delete_scheduled_run(previous_scheduled_run_id)
     return util.success("")
 
 class AdminRoutes:
@@ -349,11 +360,14 @@ class AdminRoutes:
             ):
                 return util.error("Missing fields. Please try again.")
 
-            student_netids = request.form["netids"].replace(" ", "").lower().split(",")
+            netids_str = request.form["netids"].replace(" ", "").lower()
+            student_netids = list(dict.fromkeys(netids_str.split(",")))
+            # validated against the course roster at once, rather than one lookup per NetID
+            course = db.get_course(cid)
+            roster = set(course.get("student_ids", [])) if course else set()
+            unknown = set(student_netids) - roster
             for student_netid in student_netids:
-                if not util.valid_id(student_netid) or not verify_student(
-                    student_netid, cid
-                ):
+                if not util.valid_id(student_netid) or student_netid in unknown:
                     return util.error(
                         f"Invalid or non-existent student NetID: {student_netid}"
                     )
@@ -365,33 +379,36 @@ class AdminRoutes:
             except ValueError:
                 return util.error("Max Runs must be a positive integer.")
 
-            start = util.parse_form_datetime(request.form["start"]).timestamp()
-            end = util.parse_form_datetime(request.form["end"]).timestamp()
+            start_time = util.parse_form_datetime(request.form["start"])
+            end_time = util.parse_form_datetime(request.form["end"])
+            if start_time is None or end_time is None:
+                return util.error("Missing or invalid start or end.")
+            start = start_time.timestamp()
+            end = end_time.timestamp()
             if start >= end:
                 return util.error("Start must be before End.")
 
-            for student_netid in student_netids:
-                end_str = util.parse_form_datetime(request.form["end"]).strftime(
-                    "%Y-%m-%dT%H:%M"
-                )
-                # avoid that weird race condition - start run 5 min after, but with a container due date of the original time
-                ext_end = (
-                    util.parse_form_datetime(request.form["end"]) + timedelta(minutes=5)
-                ).strftime("%Y-%m-%dT%H:%M")
-                run_id = ObjectId()
-                add_or_edit_scheduled_run(
-                    cid,
-                    aid,
-                    run_id,
-                    {
-                        "run_time": ext_end,
-                        "due_time": end_str,
-                        "name": f"Extension Run - {student_netid}",
-                        "roster": student_netid,
-                    },
-                    None,
-                )
-                db.add_extension(cid, aid, student_netid, max_runs, start, end, run_id)
+            # avoid that weird race condition - start run 5 min after, but with a container due date of the original time
+            run_time = (end_time + timedelta(minutes=5)).timestamp()
+            scheduled_run_id = None
+            if run_time > util.now_timestamp():
+                # all of the runs share one scheduler job, see add_or_edit_scheduled_run
+                scheduled_run_id = db.find_scheduler_job(cid, aid, run_time, end)
+                if scheduled_run_id is None:
+                    scheduled_run_id = sched_api.schedule_run(run_time, cid, aid)
+                if scheduled_run_id is None:
+                    return util.error("Failed to schedule run with scheduler")
+            db.add_extensions(
+                cid,
+                aid,
+                student_netids,
+                max_runs,
+                start,
+                end,
+                run_time if scheduled_run_id is not None else None,
+                end,
+                scheduled_run_id,
+            )
             return util.success("")
 
         @blueprint.route("/staff/course/<cid>/assignment/<aid>/extensions/", methods=["DELETE"])
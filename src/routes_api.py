@@ -1,11 +1,198 @@
 import json
 import logging
-from flask import request, abort
+import queue
+import time
+from uuid import uuid4
+from flask import Response, request, abort
 from http import HTTPStatus
 
 from src import db, jenkins_api, util, auth
-from src.common import verify_student_or_staff
+from src.common import verify_staff, verify_student_or_staff
 from src.sched_api import ScheduledRunStatus
+from src.status_buffer import TERMINAL_STATUS_RANK, status_rank
+
+import config
+
+# A status stream sends a comment line every STATUS_STREAM_HEARTBEAT_SECONDS so proxies keep it
+# open, and ends after STATUS_STREAM_MAX_SECONDS, after which the browser reconnects after
+# STATUS_STREAM_RETRY_MS milliseconds. Each open stream occupies one gunicorn thread.
+STATUS_STREAM_HEARTBEAT_SECONDS = getattr(config, "STATUS_STREAM_HEARTBEAT_SECONDS", 15)
+STATUS_STREAM_MAX_SECONDS = getattr(config, "STATUS_STREAM_MAX_SECONDS", 300)
+STATUS_STREAM_RETRY_MS = getattr(config, "STATUS_STREAM_RETRY_MS", 3000)
+# the most runs a status stream or batch status request may ask for
+STATUS_STREAM_MAX_RUNS = 100
+
+
+def sse_event(event, data):
+    return "event: %s\ndata: %s\n\n" % (event, json.dumps(data))
+
+
+def stream_job_statuses(subscription, rids):
+    """
+    Generate the server-sent events of a status stream: the current status of every watched
+    run, then every change to them, until all of them have finished or the stream times out.
+    Runs without a status are reported once with a null status and no longer watched.
+    :param subscription: a status hub subscription for the watched runs.
+    :param rids: the watched run IDs.
+    """
+    hub = db.status_hub
+    try:
+        yield "retry: %d\n\n" % STATUS_STREAM_RETRY_MS
+        deadline = time.monotonic() + STATUS_STREAM_MAX_SECONDS
+        watching = set(rids)
+        ranks = {}
+        resync, first = True, True
+        while watching and time.monotonic() < deadline:
+            if not hub.available:
+                yield sse_event("unavailable", None)
+                return
+            if resync:
+                # subscribed before reading, so changes made meanwhile are queued as well
+                subscription.overflowed = False
+                docs = db.get_jenkins_run_statuses(
+                    subscription.cid, watching, subscription.netid
+                )
+                if first:
+                    found = {doc["rid"] for doc in docs}
+                    docs += [{"rid": rid, "status": None} for rid in watching - found]
+                resync, first = False, False
+            else:
+                try:
+                    doc = subscription.queue.get(
+                        timeout=min(
+                            STATUS_STREAM_HEARTBEAT_SECONDS,
+                            max(deadline - time.monotonic(), 0),
+                        )
+                    )
+                except queue.Empty:
+                    yield ": heartbeat\n\n"
+                    continue
+                resync = subscription.overflowed
+                docs = [doc] if doc is not None else []
+            for doc in docs:
+                rid, status = doc["rid"], doc["status"]
+                if rid not in watching:
+                    continue
+                rank = status_rank(status)
+                # a change that was queued before a fresher read must not move the status back
+                if rank < ranks.get(rid, 0):
+                    continue
+                ranks[rid] = rank
+                if status is None or rank >= TERMINAL_STATUS_RANK:
+                    watching.discard(rid)
+                yield sse_event("status", {"run_id": rid, "status": status})
+        if not watching:
+            yield sse_event("done", None)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def trigger_coalesced_runs(cid, aid, run_time, due_time):
+    """
+    Start one grading run for all of the pending scheduled runs of an assignment with the same
+    run time and due time, over the union of their rosters. Each student's job reports under
+    the run's ID, so their statuses are tracked as if their runs had been started separately.
+    :return: the number of errors.
+    """
+    bw_run_id = str(uuid4())
+    sched_runs = db.claim_scheduled_runs(cid, aid, run_time, due_time, bw_run_id)
+    if not sched_runs:
+        # already started by the trigger of another scheduler job
+        return 0
+    rids = [sched_run["_id"] for sched_run in sched_runs]
+
+    # If a run has no roster, it covers the course roster
+    if any(sched_run["roster"] is None for sched_run in sched_runs):
+        course = db.get_course(cid)
+        if course is None:
+            db.set_scheduled_runs_outcome(rids, ScheduledRunStatus.FAILED)
+            return 1
+        netids = course["student_ids"]
+    else:
+        netids = list(
+            dict.fromkeys(
+                netid for sched_run in sched_runs for netid in sched_run["roster"]
+            )
+        )
+    logging.info(
+        "Starting %d scheduled runs of %s/%s for %d students as run '%s'",
+        len(sched_runs),
+        cid,
+        aid,
+        len(netids),
+        bw_run_id,
+    )
+
+    if jenkins_api.SCHEDULED_RUN_SHARDING:
+        _, shards = jenkins_api.start_sharded_grading_run(
+            cid, aid, netids, due_time, True, bw_run_id
+        )
+        failed = [
+            shard for shard in shards if shard["status"] == ScheduledRunStatus.FAILED
+        ]
+        status = (
+            ScheduledRunStatus.FAILED
+            if len(failed) == len(shards)
+            else ScheduledRunStatus.RAN
+        )
+        db.set_scheduled_runs_outcome(rids, status, shards)
+        if failed:
+            logging.warning(
+                "Failed to trigger %d of %d builds of run '%s'",
+                len(failed),
+                len(shards),
+                bw_run_id,
+            )
+            return 1
+        return 0
+
+    started = jenkins_api.start_grading_run(cid, aid, netids, due_time, True, bw_run_id)
+    if started is None:
+        logging.warning("Failed to trigger run with broadway")
+        db.set_scheduled_runs_outcome(rids, ScheduledRunStatus.FAILED)
+        return 1
+    return 0
+
+
+def trigger_scheduled_job(cid, aid, scheduled_run_id):
+    """
+    Start the scheduled runs of a scheduler job that has fired.
+    :param scheduled_run_id: the ID of the scheduler job.
+    :return: the number of errors.
+    """
+    sched_runs = db.get_scheduled_run_by_scheduler_id(cid, aid, scheduled_run_id)
+    if len(sched_runs) == 0:
+        logging.warning(
+            "Received trigger scheduled run request for scheduled_run_id '%s' but cannot find corresponding run.",
+            scheduled_run_id,
+        )
+        return 1
+    errors = 0
+    # runs sharing a run time and due time are started together, in one build
+    times = []
+    for sched_run in sched_runs:
+        if sched_run.get("broadway_run_id") is not None:
+            # already claimed by a build started for a coalesced run of another job
+            logging.info(
+                "Scheduled run '%s' was already started as run '%s'",
+                str(sched_run["_id"]),
+                sched_run["broadway_run_id"],
+            )
+            continue
+        if sched_run["status"] != ScheduledRunStatus.SCHEDULED:
+            logging.warning(
+                "Received trigger scheduled run for _id '%s' but this run has status '%s', which is not 'scheduled'.",
+                str(sched_run["_id"]),
+                sched_run["status"],
+            )
+            errors += 1
+            continue
+        key = (sched_run["run_time"], sched_run["due_time"])
+        if key not in times:
+            times.append(key)
+    for run_time, due_time in times:
+        errors += trigger_coalesced_runs(cid, aid, run_time, due_time)
+    return errors
 
 
 class ApiRoutes:
@@ -24,52 +211,61 @@ class ApiRoutes:
             except Exception:
                 return util.error("")
 
+        @blueprint.route("/jenkins/run_status/<cid>", methods=["GET"])
+        @util.disable_in_maintenance_mode
+        @auth.require_auth
+        @util.catch_request_errors
+        def student_get_job_statuses(netid, cid):
+            """
+            Get the statuses of the runs listed in the comma-separated `ids` query parameter,
+            as an object mapping run IDs to statuses. Runs without a status are left out. Staff
+            may query any run in the course, students only their own.
+            """
+            if not verify_student_or_staff(netid, cid):
+                return abort(HTTPStatus.FORBIDDEN)
+            rids = [rid for rid in request.args.get("ids", "").split(",") if rid]
+            if not rids or len(rids) > STATUS_STREAM_MAX_RUNS:
+                return util.error(
+                    "Between 1 and %d runs must be given." % STATUS_STREAM_MAX_RUNS
+                )
+            viewer = None if verify_staff(netid, cid) else netid
+            docs = db.get_jenkins_run_statuses(cid, rids, viewer)
+            return util.success({doc["rid"]: doc["status"] for doc in docs}, 200)
+
+        @blueprint.route("/jenkins/run_status/<cid>/stream", methods=["GET"])
+        @util.disable_in_maintenance_mode
+        @auth.require_auth
+        @util.catch_request_errors
+        def student_stream_job_statuses(netid, cid):
+            """
+            Stream the statuses of the runs listed in the comma-separated `runs` query parameter
+            as server-sent events. Staff may watch any run in the course, students only their own.
+            """
+            if not verify_student_or_staff(netid, cid):
+                return abort(HTTPStatus.FORBIDDEN)
+            rids = [rid for rid in request.args.get("runs", "").split(",") if rid]
+            if not rids or len(rids) > STATUS_STREAM_MAX_RUNS:
+                return util.error(
+                    "Between 1 and %d runs must be given." % STATUS_STREAM_MAX_RUNS
+                )
+            viewer = None if verify_staff(netid, cid) else netid
+            subscription = db.status_hub.subscribe(cid, viewer, rids)
+            if subscription is None:
+                return util.error(
+                    "Status streaming is unavailable.", HTTPStatus.SERVICE_UNAVAILABLE
+                )
+            return Response(
+                stream_job_statuses(subscription, rids),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
         @blueprint.route(
             "/api/<cid>/assignment/<aid>/trigger_scheduled_run/<scheduled_run_id>",
             methods=["POST"],
         )
         @auth.require_system_auth
         def trigger_scheduled_run(cid, aid, scheduled_run_id):
-            sched_runs = db.get_scheduled_run_by_scheduler_id(cid, aid, scheduled_run_id)
-            if len(sched_runs) == 0:
-                logging.warning(
-                    "Received trigger scheduled run request for scheduled_run_id '%s' but cannot find corresponding run.",
-                    scheduled_run_id,
-                )
-                return util.error("")
-            errors = 0
-            for sched_run in sched_runs:
-                if sched_run["status"] != ScheduledRunStatus.SCHEDULED:
-                    logging.warning(
-                        "Received trigger scheduled run for _id '%s' but this run has status '%s', which is not 'scheduled'.",
-                        str(sched_run["_id"]),
-                        sched_run["status"],
-                    )
-                    errors += 1
-
-                # If roster is not provided, use course roster
-                if sched_run["roster"] is None:
-                    course = db.get_course(cid)
-                    if course is None:
-                        errors += 1
-                    netids = course["student_ids"]
-                # If a roster is provided, use it
-                else:
-                    netids = sched_run["roster"]
-
-                # Start broadway grading run
-                bw_run_id = jenkins_api.start_grading_run(
-                    cid, aid, netids, sched_run["due_time"], True, None
-                )
-                if bw_run_id is None:
-                    logging.warning("Failed to trigger run with broadway")
-                    db.update_scheduled_run_status(
-                        sched_run["_id"], ScheduledRunStatus.FAILED
-                    )
-                    errors += 1
-                else:
-                    db.update_scheduled_run_status(sched_run["_id"], ScheduledRunStatus.RAN)
-                    db.update_scheduled_run_bw_run_id(sched_run["_id"], bw_run_id)
-            if errors > 0:
+            if trigger_scheduled_job(cid, aid, scheduled_run_id) > 0:
                 return util.error("")
             return util.success("")
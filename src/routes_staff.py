@@ -1,11 +1,13 @@
 from subprocess import check_output, CalledProcessError
 from http import HTTPStatus
 import logging
-from flask import render_template, abort, jsonify
+from flask import Response, render_template, abort, jsonify, request
+from requests.exceptions import RequestException
 
 from config import BASE_URL, JENKINS_API_URL, TZ
 from src import db, jenkins_api, util, auth, sched_api
 from src.common import verify_staff, verify_admin
+from src.status_buffer import is_final_status
 
 import pathlib
 import subprocess
@@ -98,6 +100,13 @@ class StaffRoutes:
             assignment = db.get_assignment(cid, aid)
             student_runs = list(db.get_assignment_runs(cid, aid))
             scheduled_runs = list(db.get_scheduled_runs(cid, aid))
+            run_statuses = {
+                doc["rid"]: doc["status"]
+                for doc in db.get_jenkins_run_statuses(
+                    cid,
+                    [run["_id"] for student in student_runs for run in student["runs"]],
+                )
+            }
             is_admin = verify_admin(netid, cid)
             assignment["end_plus_one_minute"] = assignment["end"] + 60
             return render_template(
@@ -106,6 +115,7 @@ class StaffRoutes:
                 course=course,
                 assignment=assignment,
                 student_runs=student_runs,
+                run_statuses=run_statuses,
                 scheduled_runs=scheduled_runs,
                 sched_run_status=sched_api.ScheduledRunStatus,
                 tzname=str(TZ),
@@ -126,15 +136,57 @@ class StaffRoutes:
             data = db.get_jenkins_run_status_single(cid, run_id, stu_id)
             if not data or data == {}:
                 return util.error("")
+            finished = is_final_status(data.get("status"))
             try:
                 stuff = jenkins_api.get_grading_run_log(
-                    cid, aid, data["build_url"], stu_id
+                    cid, aid, data["build_url"], stu_id, finished
                 )
                 return jsonify({"data": stuff, "build_url": data["build_url"]})
             except Exception as e:
                 print(e, flush=True)
                 return util.error("")
 
+        @blueprint.route(
+            "/staff/course/<cid>/assignment/<aid>/<run_id>/<stu_id>/run_log/stream",
+            methods=["GET"],
+        )
+        @auth.require_auth
+        def staff_stream_run_log(netid, cid, aid, run_id, stu_id):
+            """
+            Stream a student's job log from the byte offset in the `start` query parameter, as
+            plain text, or as HTML with ANSI colors if `html=1`. The X-Text-Size header holds the
+            offset to request next, and X-More-Data tells whether the log may still grow.
+            """
+            if not verify_staff(netid, cid):
+                return abort(HTTPStatus.FORBIDDEN)
+
+            data = db.get_jenkins_run_status_single(cid, run_id, stu_id)
+            if not data or not data.get("build_url"):
+                return util.error("")
+            start = request.args.get("start", 0, type=int)
+            as_html = request.args.get("html") == "1"
+            finished = is_final_status(data.get("status"))
+            try:
+                log = jenkins_api.stream_grading_run_log(
+                    cid, aid, data["build_url"], stu_id, start, finished
+                )
+            except Exception as e:
+                logger.error("Failed to fetch log of %s in %s: %s", stu_id, run_id, e)
+                return util.error("", HTTPStatus.BAD_GATEWAY)
+            if log is None:
+                return util.error("", HTTPStatus.NOT_FOUND)
+            chunks, text_size, more_data = log
+            return Response(
+                jenkins_api.iter_log_text(chunks, as_html),
+                mimetype="text/html" if as_html else "text/plain",
+                headers={
+                    "Cache-Control": "no-cache",
+                    "X-Text-Size": str(text_size),
+                    "X-More-Data": "true" if more_data else "false",
+                    "X-Build-Url": data["build_url"],
+                },
+            )
+
         @blueprint.route("/staff/course/<cid>/assignment/<aid>/<job_id>/job_log/", methods=["GET"])
         @auth.require_auth
         def staff_get_job_log(netid, cid, aid, job_id):
@@ -144,8 +196,11 @@ class StaffRoutes:
             data = db.get_jenkins_run_status_single(cid, job_id, netid)
             if not data or data == {}:
                 return util.error("")
+            finished = is_final_status(data.get("status"))
             try:
-                stuff = jenkins_api.get_grading_run_log(cid, aid, data["build_url"])
+                stuff = jenkins_api.get_grading_run_log(
+                    cid, aid, data["build_url"], netid, finished
+                )
                 return jsonify({"data": stuff, "build_url": data["build_url"]})
             except Exception as e:
                 print(e, flush=True)
@@ -157,10 +212,12 @@ class StaffRoutes:
             if not verify_staff(netid, cid):
                 return abort(HTTPStatus.FORBIDDEN)
 
-            workers = jenkins_api.get_workers(cid)
-            if workers is not None:
-                return util.success(jsonify(workers), HTTPStatus.OK)
-            return util.error("")
+            try:
+                workers = jenkins_api.get_workers(cid)
+            except (RequestException, KeyError) as e:
+                logger.error("Failed to fetch Jenkins workers: %r", e)
+                return util.error("", HTTPStatus.BAD_GATEWAY)
+            return util.success(jsonify(workers), HTTPStatus.OK)
 
         @blueprint.route("/staff/course/<cid>/assignment/<aid>/<run_id>/detail", methods=["GET"])
         @auth.require_auth
@@ -168,10 +225,40 @@ class StaffRoutes:
             """
             Return details of the run in the following format
                 [{jobId: <job id>, netid: <student net id>}, ...]
+            Scheduled runs with the same times are started together, so a `scheduled_run` query
+            parameter limits the details to the roster of that scheduled run.
             """
             if not verify_staff(netid, cid):
                 return abort(HTTPStatus.FORBIDDEN)
             detail = jenkins_api.get_grading_run_details(cid, run_id)
+            sched_run_id = request.args.get("scheduled_run")
+            if detail is not None and sched_run_id:
+                sched_run = db.get_scheduled_run(cid, aid, sched_run_id)
+                if sched_run is not None and sched_run["roster"] is not None:
+                    roster = set(sched_run["roster"])
+                    detail = [job for job in detail if job["netid"] in roster]
             if detail is not None:
                 return util.success(jsonify(detail), HTTPStatus.OK)
             return util.error("")
+
+        @blueprint.route(
+            "/staff/course/<cid>/assignment/<aid>/<run_id>/summary", methods=["GET"]
+        )
+        @auth.require_auth
+        def staff_get_run_summary(netid, cid, aid, run_id):
+            """
+            Return the number of jobs of the run with each status, across all of its builds, as
+                {<status>: <number of jobs>, ...}
+            Like the details, the counts are limited to the roster of the scheduled run given by
+            the `scheduled_run` query parameter.
+            """
+            if not verify_staff(netid, cid):
+                return abort(HTTPStatus.FORBIDDEN)
+            netids = None
+            sched_run_id = request.args.get("scheduled_run")
+            if sched_run_id:
+                sched_run = db.get_scheduled_run(cid, aid, sched_run_id)
+                if sched_run is not None:
+                    netids = sched_run["roster"]
+            counts = db.get_jenkins_run_status_counts(cid, run_id, netids)
+            return util.success(jsonify(counts), HTTPStatus.OK)
@@ -3,10 +3,12 @@ import json
 import traceback
 from typing import List
 from bson import ObjectId
-from flask import render_template, request, abort
+from concurrent.futures import TimeoutError
+from flask import make_response, render_template, request, abort
 from http import HTTPStatus
 import math
 
+import config
 from config import BASE_URL, TZ, DEV_MODE
 from src import auth, jenkins_api, util, db
 from src.common import (
@@ -14,15 +16,43 @@ from src.common import (
     verify_staff,
     get_available_runs,
     get_active_extensions,
+    get_grade_summary,
+    get_quota_summary,
+    reserve_grading_run,
 )
 from src.ghe_api import get_latest_commit
+from src.page_loads import PageLoads
 from src.types import GradeEntry
-from src.util import bin_scores, compute_statistics, verify_csrf_token, restore_csrf_token
+from src.util import verify_csrf_token, restore_csrf_token
 from src.routes_admin import add_or_edit_scheduled_run
 from uuid import uuid4
 
 NO_EXTENSION_ASSIGNMENTS = set(['malloc_contest', 'lovable_linux'])
 
+# Seconds the student assignment page waits for the latest GitHub commit before rendering
+# without it
+GHE_COMMIT_DEADLINE = getattr(config, "GHE_COMMIT_DEADLINE", 2)
+COMMIT_UNAVAILABLE = {
+    "message": "Commit unavailable. Please refresh to try again.",
+    "sha": "",
+    "url": "",
+}
+
+
+def load_student_runs(cid, aid, netid):
+    """
+    Load a student's runs of an assignment, newest first, with their statuses.
+    :return: a (runs, run_statuses) tuple, where run_statuses maps run IDs to statuses.
+    """
+    runs = db.get_assignment_runs_for_student(cid, aid, netid)
+    run_statuses = {
+        doc["rid"]: doc["status"]
+        for doc in db.get_jenkins_run_statuses(
+            cid, [run["_id"] for run in runs], netid
+        )
+    }
+    return runs, run_statuses
+
 def compute_extension_parameters(assignment, extension_info):
     num_periods = 0
     num_runs_per_period = 0
@@ -54,23 +84,22 @@ class StudentRoutes:
             if not verify_student_or_staff(netid, cid):
                 return abort(HTTPStatus.FORBIDDEN)
 
-            if verify_staff(netid, cid):
+            is_staff = verify_staff(netid, cid)
+            if is_staff:
                 assignments = db.get_assignments_for_course(cid)
             else:
                 assignments = db.get_assignments_for_course(cid, visible_only=True)
 
             now = util.now_timestamp()
+            quotas = get_quota_summary(cid, netid, assignments, now)
 
             for assignment in assignments:
-                num_available_runs = get_available_runs(
-                    cid, assignment["assignment_id"], netid, now
-                )
-                active_extensions, num_extension_runs = get_active_extensions(
-                    cid, assignment["assignment_id"], netid, now
-                )
+                num_available_runs, num_extension_runs = quotas[
+                    assignment["assignment_id"]
+                ]
                 total_available_runs = num_extension_runs + num_available_runs
 
-                if verify_staff(netid, cid):
+                if is_staff:
                     total_available_runs = max(total_available_runs, 1)
 
                 assignment.update({"total_available_runs": total_available_runs})
@@ -92,22 +121,8 @@ class StudentRoutes:
                 return abort(HTTPStatus.FORBIDDEN)
 
             course = db.get_course(cid)
-            all_grades = db.get_course_grades(cid)
-            grades_parsed: List[GradeEntry] = []
-            for assignment in all_grades:
-                assignment_grades = []
-                for student in assignment['data']:
-                    assignment_grades.append(float(student['score']))
-                real_name = assignment['name'].replace("_", " ").title()
-                result = compute_statistics(real_name, assignment['type'], assignment_grades)
-                result['bins'] = bin_scores(assignment_grades)
-                try:
-                    filtered = [float(x['score']) for x in assignment['data'] if x['netid'] == netid]
-                    result['score'] = round(filtered[0], 3)
-                except Exception:
-                    result['score'] = 0
-                grades_parsed.append(result)
-  
+            grades_parsed: List[GradeEntry] = get_grade_summary(cid, netid)
+
             return render_template("student/grades.html", netid=netid, course=course, grades=json.dumps(grades_parsed))
 
         @blueprint.route("/student/course/<cid>/extensions/", methods=["GET"])
@@ -269,26 +284,43 @@ class StudentRoutes:
                 return abort(HTTPStatus.FORBIDDEN)
 
             course = db.get_course(cid)
-            assignment = db.get_assignment(cid, aid)
-            runs = db.get_assignment_runs_for_student(cid, aid, netid)
             now = util.now_timestamp()
 
-            num_available_runs = get_available_runs(cid, aid, netid, now)
-            active_extensions, num_extension_runs = get_active_extensions(
-                cid, aid, netid, now
+            # the loads below are independent, so they run concurrently
+            loads = PageLoads()
+            if not DEV_MODE:
+                commit_future = loads.submit_remote(
+                    "github",
+                    get_latest_commit,
+                    netid,
+                    course.get("github_token", ""),
+                    course["github_org"],
+                    course["github_repo_prefix"],
+                )
+            assignment_future = loads.submit("assignment", db.get_assignment, cid, aid)
+            runs_future = loads.submit("runs", load_student_runs, cid, aid, netid)
+            available_future = loads.submit(
+                "quota", get_available_runs, cid, aid, netid, now
+            )
+            extensions_future = loads.submit(
+                "extensions", get_active_extensions, cid, aid, netid, now
             )
 
-            user = db.get_user(netid)
-            token = course.get("github_token", "")
+            assignment = assignment_future.result()
+            runs, run_statuses = runs_future.result()
+            num_available_runs = available_future.result()
+            active_extensions, num_extension_runs = extensions_future.result()
             commit = {
                 "message": "This is a test commit.",
                 "sha": "2db06991c7846ade1b505e80fbaf257e034c4bd5",
                 "url": "https://github.com/illinois-cs241/broadway-on-demand",
             }
             if not DEV_MODE:
-                commit = get_latest_commit(
-                    netid, token, course["github_org"], course["github_repo_prefix"]
-                )
+                try:
+                    commit = commit_future.result(timeout=GHE_COMMIT_DEADLINE)
+                except TimeoutError:
+                    # the lookup goes on in the background and fills the commit cache
+                    commit = COMMIT_UNAVAILABLE
             feedback_url = (
                 f'https://github.com/{course["github_org"]}/{course["github_repo_prefix"]}_{netid}/tree/{course["feedback_branch_name"]}'
                 if "feedback_branch_name" in course
@@ -297,19 +329,24 @@ class StudentRoutes:
             if verify_staff(netid, cid):
                 num_available_runs = max(num_available_runs, 1)
 
-            return render_template(
-                "student/assignment.html",
-                base_url=BASE_URL,
-                netid=netid,
-                course=course,
-                assignment=assignment,
-                commit=commit,
-                runs=runs,
-                num_available_runs=num_available_runs,
-                num_extension_runs=num_extension_runs,
-                tzname=str(TZ),
-                feedback_url=feedback_url,
+            response = make_response(
+                render_template(
+                    "student/assignment.html",
+                    base_url=BASE_URL,
+                    netid=netid,
+                    course=course,
+                    assignment=assignment,
+                    commit=commit,
+                    runs=runs,
+                    run_statuses=run_statuses,
+                    num_available_runs=num_available_runs,
+                    num_extension_runs=num_extension_runs,
+                    tzname=str(TZ),
+                    feedback_url=feedback_url,
+                )
             )
+            response.headers["Server-Timing"] = loads.server_timing()
+            return response
 
         @blueprint.route("/student/course/<cid>/assignment/<aid>/run/", methods=["POST"])
         @util.disable_in_maintenance_mode
@@ -321,34 +358,30 @@ class StudentRoutes:
                 return abort(HTTPStatus.BAD_REQUEST)
 
             now = util.now_timestamp()
-            ext_to_use = None
             current_csrf_token = request.form.get("csrf_token")
+            run_id = str(uuid4())
 
-            if not verify_staff(netid, cid):
-                # not a staff member; perform quota checks
-                num_available_runs = get_available_runs(cid, aid, netid, now)
-                active_extensions, num_extension_runs = get_active_extensions(
-                    cid, aid, netid, now
-                )
-                if num_available_runs + num_extension_runs <= 0:
+            if verify_staff(netid, cid):
+                db.add_grading_run(cid, aid, netid, now, run_id)
+                reservation = {"run_id": run_id, "extension_used": None}
+            else:
+                # not a staff member; check and consume quota in one atomic step
+                reservation = reserve_grading_run(cid, aid, netid, run_id, now)
+                if reservation is None:
                     restore_csrf_token(current_csrf_token)
                     return util.error("No grading runs available.")
-                if num_available_runs <= 0:
-                    # find the extension that is closest to expiration
-                    ext_to_use = min(active_extensions, key=lambda ext: ext["end"])
 
             now_rounded = util.timestamp_round_up_minute(now)
-            run_id = str(uuid4())
-            db.add_grading_run(cid, aid, netid, now, run_id, extension_used=ext_to_use)
             run_status = jenkins_api.start_grading_run(
                 cid, aid, [netid], now_rounded, False, grading_run_id=run_id
             )
             if run_status is None:
                 restore_csrf_token(current_csrf_token)
-                db.remove_grading_run(cid, aid, netid, run_id, extension_used=ext_to_use)
+                db.release_grading_run(cid, aid, netid, reservation)
                 return util.error("Failed to start grading run. Please try again.")
+            # the page is reloaded next and renders this status, so it must not be buffered
             db.set_jenkins_run_status(
-                cid, run_id, "scheduled", None, netid
+                cid, run_id, "scheduled", None, netid, buffered=False
             )  # null refers to the overall job, which for one-user jobs is what we want.
 
             return util.success("")
@@ -1,6 +1,15 @@
-from flask import request
+from types import NoneType
+from flask import request, jsonify
 from http import HTTPStatus
-from src import db
+from src import (
+    db,
+    ghe_api,
+    http_client,
+    jenkins_api,
+    local_scheduler,
+    page_loads,
+    util,
+)
 from config import SYSTEM_API_TOKEN
 
 
@@ -32,3 +41,74 @@ class SystemRoutes:
                 print(e, flush=True)
                 return "Could not save status.", HTTPStatus.INTERNAL_SERVER_ERROR
             return "Status saved.", HTTPStatus.OK
+
+        @blueprint.route("/system/statusping/batch", methods=["POST"])
+        def set_job_statuses():
+            """
+            Save many job statuses at once. Takes a JSON array of objects with cid, rid, netid,
+            status and (optionally) build_url fields, and returns an array with an
+            {"ok": <bool>, "error": <message or null>} result for each of them.
+            """
+            if request.headers.get("Authorization") != ("Bearer %s" % SYSTEM_API_TOKEN):
+                return "Unauthorized", HTTPStatus.UNAUTHORIZED
+            data = request.get_json(silent=True)
+            if not isinstance(data, list):
+                return "Expected a JSON array of statuses.", HTTPStatus.BAD_REQUEST
+
+            errors = [None] * len(data)
+            updates, positions = [], []
+            for i, item in enumerate(data):
+                if not isinstance(item, dict):
+                    errors[i] = "Expected an object."
+                    continue
+                missing = util.check_missing_fields(
+                    item, "cid", "rid", "netid", "status"
+                )
+                if missing:
+                    errors[i] = f"Missing fields ({', '.join(missing)})."
+                    continue
+                # anything else could act as a query operator or fail the whole batch
+                invalid = [
+                    field
+                    for field in ("cid", "rid", "netid", "status")
+                    if not isinstance(item[field], str)
+                ]
+                if not isinstance(item.get("build_url"), (str, NoneType)):
+                    invalid.append("build_url")
+                if invalid:
+                    errors[i] = f"Invalid fields ({', '.join(invalid)})."
+                    continue
+                updates.append(
+                    {
+                        "cid": item["cid"],
+                        "rid": item["rid"],
+                        "netid": item["netid"],
+                        "status": item["status"],
+                        "build_url": item.get("build_url"),
+                    }
+                )
+                positions.append(i)
+            try:
+                for i, error in zip(positions, db.set_jenkins_run_statuses(updates)):
+                    errors[i] = error
+            except Exception as e:
+                print(e, flush=True)
+                return "Could not save statuses.", HTTPStatus.INTERNAL_SERVER_ERROR
+            return jsonify([{"ok": error is None, "error": error} for error in errors])
+
+        @blueprint.route("/system/stats/", methods=["GET"])
+        def system_stats():
+            if request.headers.get("Authorization") != ("Bearer %s" % SYSTEM_API_TOKEN):
+                return "Unauthorized", HTTPStatus.UNAUTHORIZED
+            return jsonify(
+                {
+                    "cache": db.cache_stats(),
+                    "jenkins_status_buffer": db.status_buffer_stats(),
+                    "status_streams": db.status_hub_stats(),
+                    "http": http_client.stats(),
+                    "jenkins_logs": jenkins_api.log_cache_stats(),
+                    "github": ghe_api.cache_stats(),
+                    "page_stages": page_loads.stage_stats(),
+                    "scheduler": local_scheduler.stats(),
+                }
+            )
@@ -1,8 +1,15 @@
 import logging
-import requests
-from src import util
+from src import http_client, local_scheduler, util
 from http import HTTPStatus
-from config import SCHEDULER_URI
+
+import config
+
+# "http" uses the external scheduler at SCHEDULER_URI, which calls back the
+# trigger_scheduled_run API when a run is due; "local" uses the scheduler built into the app,
+# see src/local_scheduler.py.
+SCHEDULER_BACKEND = getattr(config, "SCHEDULER_BACKEND", "http")
+SCHEDULER_URI = getattr(config, "SCHEDULER_URI", None)
+LOCAL_BACKEND = "local"
 
 
 class ScheduledRunStatus:
@@ -21,13 +28,15 @@ def schedule_run(time, cid, aid):
     :return: scheduled run id, an id for the run that we just scheduled. If
         an error occurs, return None.
     """
+    if SCHEDULER_BACKEND == LOCAL_BACKEND:
+        return local_scheduler.schedule_run(time, cid, aid)
     url = f"{SCHEDULER_URI}/api/schedule_run"
     data = {
         "time": util.timestamp_to_iso(time),
         "course_id": cid,
         "assignment_id": aid,
     }
-    resp = requests.post(url=url, data=data)
+    resp = http_client.post(url=url, data=data)
     return resp.json()["scheduled_run_id"]
 
 
@@ -37,11 +46,13 @@ def update_scheduled_run(scheduled_run_id, time):
     Update a already scheduled run. The only parameter we can update is time.
     :return: True if the update was successful, False otherwise.
     """
+    if SCHEDULER_BACKEND == LOCAL_BACKEND:
+        return local_scheduler.update_scheduled_run(scheduled_run_id, time)
     url = f"{SCHEDULER_URI}/api/{scheduled_run_id}"
     data = {
         "time": util.timestamp_to_iso(time),
     }
-    resp = requests.post(url=url, data=data)
+    resp = http_client.post(url=url, data=data)
     is_success = resp.status_code == HTTPStatus.OK
     if not is_success:
         logging.warning("Failed to update scheduled run: %s", resp.text)
@@ -54,8 +65,10 @@ def delete_scheduled_run(scheduled_run_id):
     Delete a scheduled run with the given id.
     :return: True if the delete was successful, False otherwise.
     """
+    if SCHEDULER_BACKEND == LOCAL_BACKEND:
+        return local_scheduler.delete_scheduled_run(scheduled_run_id)
     url = f"{SCHEDULER_URI}/api/{scheduled_run_id}"
-    resp = requests.delete(url=url)
+    resp = http_client.delete(url=url)
     is_success = resp.status_code == HTTPStatus.OK
     if not is_success:
         logging.warning("Failed to delete scheduled run: %s", resp.text)
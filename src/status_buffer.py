@@ -0,0 +1,134 @@
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Statuses only move forward; a buffered status is never replaced by one of a lower rank, so a
+# "running" ping that arrives late cannot overwrite "success". Statuses may carry extra text,
+# so they are matched by substring, and unknown statuses rank lowest.
+STATUS_RANKS = (
+    ("scheduled", 1),
+    ("running", 2),
+    ("success", 3),
+    ("failed", 3),
+    ("error", 3),
+)
+
+# the rank of statuses after which a job's status no longer changes
+TERMINAL_STATUS_RANK = 3
+
+
+def status_rank(status):
+    for name, rank in STATUS_RANKS:
+        if status and name in status:
+            return rank
+    return 0
+
+
+def is_final_status(status):
+    return status_rank(status) >= TERMINAL_STATUS_RANK
+
+
+class StatusBuffer:
+    """
+    An in-process write-behind buffer for jenkins_run_status updates. Updates are coalesced per
+    (cid, rid, netid) and written in bulk by a background thread every `interval` seconds, as
+    soon as `max_items` keys are pending, and once more when the process exits.
+    """
+
+    def __init__(self, write, interval, max_items):
+        """
+        :param write: a function taking a list of updates and saving them, e.g. with one
+            bulk write.
+        :param interval: the maximum number of seconds an update stays buffered.
+        :param max_items: the number of pending keys that triggers an early flush.
+        """
+        self._write = write
+        self.interval = interval
+        self.max_items = max_items
+        self._pending = {}
+        self._lock = threading.Lock()
+        # serializes flushes so that batches are written in the order they were taken
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.received = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    def _merge(self, update):
+        key = (update["cid"], update["rid"], update["netid"])
+        current = self._pending.get(key)
+        if current is None or status_rank(update["status"]) >= status_rank(
+            current["status"]
+        ):
+            self._pending[key] = update
+
+    def add(self, update):
+        with self._lock:
+            self.received += 1
+            self._merge(update)
+            full = len(self._pending) >= self.max_items
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending.values())
+                self._pending = {}
+            if not batch:
+                return
+            start = time.monotonic()
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error("Failed to flush %d job statuses: %s", len(batch), e)
+                with self._lock:
+                    self.failed_flushes += 1
+                    # newer updates that arrived meanwhile still win by rank
+                    pending, self._pending = self._pending, {}
+                    for update in batch + list(pending.values()):
+                        self._merge(update)
+                return
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.written += len(batch)
+                self.flushes += 1
+                self.flush_seconds += elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name="status-buffer", daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+        return thread
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "received": self.received,
+                "written": self.written,
+                "coalescing_ratio": (
+                    round(self.received / self.written, 3) if self.written else 0
+                ),
+                "flushes": self.flushes,
+                "failed_flushes": self.failed_flushes,
+                "mean_flush_ms": (
+                    round(self.flush_seconds / self.flushes * 1000, 3)
+                    if self.flushes
+                    else 0
+                ),
+                "max_flush_ms": round(self.max_flush_seconds * 1000, 3),
+            }
@@ -0,0 +1,166 @@
+import logging
+import queue
+import threading
+import time
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# The error code of a change stream opened on a server that is not a replica set; any other
+# error of a change stream is retried
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+class Subscription:
+    """
+    A viewer of job statuses in one course. Matching status documents are put on `queue`;
+    if the viewer falls behind and the queue fills up, further documents are dropped and
+    `overflowed` is set so the viewer can resynchronize.
+    """
+
+    def __init__(self, cid, netid, rids, queue_size):
+        """
+        :param cid: a course ID.
+        :param netid: the only student whose statuses are delivered, or None for all students.
+        :param rids: the run IDs being watched.
+        :param queue_size: the maximum number of undelivered documents.
+        """
+        self.cid = cid
+        self.netid = netid
+        self.rids = set(rids)
+        self.queue = queue.Queue(queue_size)
+        self.overflowed = False
+
+    def matches(self, doc):
+        return (
+            doc.get("cid") == self.cid
+            and doc.get("rid") in self.rids
+            and (self.netid is None or doc.get("netid") == self.netid)
+        )
+
+    def offer(self, doc):
+        try:
+            self.queue.put_nowait(doc)
+        except queue.Full:
+            self.overflowed = True
+
+
+class StatusHub:
+    """
+    Fans out job status changes to the viewers in this process. A single background thread
+    follows the changes, so N open pages cost one change stream per worker rather than N
+    polling loops. Since every open stream holds a server thread, the number of subscriptions
+    per process is bounded.
+    """
+
+    def __init__(self, watch, queue_size, retry_seconds, max_subscriptions):
+        """
+        :param watch: a function taking a callback, which it calls with every changed status
+            document until the change stream fails, and a function it calls once the change
+            stream is open. It raises OperationFailure with code CHANGE_STREAMS_UNSUPPORTED if
+            change streams are not supported by the server.
+        :param queue_size: the queue size of each subscription.
+        :param retry_seconds: the delay before reopening an interrupted change stream.
+        :param max_subscriptions: the maximum number of subscriptions at a time.
+        """
+        self._watch = watch
+        self.queue_size = queue_size
+        self.retry_seconds = retry_seconds
+        self.max_subscriptions = max_subscriptions
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        # whether changes may have been missed since the change stream was last open; the
+        # first subscriber reads its statuses before the stream is first opened
+        self._interrupted = True
+        self.available = True
+        self.published = 0
+        self.delivered = 0
+        self.rejected = 0
+        self.interruptions = 0
+
+    def subscribe(self, cid, netid, rids):
+        """
+        Start watching the given runs, starting the watcher thread on first use.
+        :return: a Subscription, or None if change streams are not available or too many
+            subscriptions are open.
+        """
+        with self._lock:
+            if not self.available:
+                return None
+            if len(self._subscriptions) >= self.max_subscriptions:
+                self.rejected += 1
+                return None
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="status-stream-watcher", daemon=True
+                )
+                self._thread.start()
+            subscription = Subscription(cid, netid, rids, self.queue_size)
+            self._subscriptions.add(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, doc):
+        with self._lock:
+            self.published += 1
+            subscriptions = [s for s in self._subscriptions if s.matches(doc)]
+            self.delivered += len(subscriptions)
+        for subscription in subscriptions:
+            subscription.offer(doc)
+
+    def _resync_all(self, subscriptions):
+        # wake up the viewers and have them read the current statuses again
+        for subscription in subscriptions:
+            subscription.overflowed = True
+            subscription.offer(None)
+
+    def _opened(self):
+        with self._lock:
+            interrupted, self._interrupted = self._interrupted, False
+            subscriptions = list(self._subscriptions)
+        # changes made while the stream was closed were not published; reading the statuses
+        # after the stream reopened leaves no gap
+        if interrupted:
+            self._resync_all(subscriptions)
+
+    def _run(self):
+        while True:
+            try:
+                self._watch(self.publish, self._opened)
+            except OperationFailure as e:
+                if e.code != CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("Status change stream interrupted: %s", e)
+                    self._retry()
+                    continue
+                logger.warning("Status change stream unavailable: %s", e)
+                with self._lock:
+                    self.available = False
+                    subscriptions, self._subscriptions = self._subscriptions, set()
+                # the viewers fall back to polling
+                self._resync_all(subscriptions)
+                return
+            except Exception as e:
+                logger.warning("Status change stream interrupted: %s", e)
+            self._retry()
+
+    def _retry(self):
+        with self._lock:
+            self._interrupted = True
+            self.interruptions += 1
+        time.sleep(self.retry_seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "available": self.available,
+                "subscribers": len(self._subscriptions),
+                "published": self.published,
+                "delivered": self.delivered,
+                "rejected": self.rejected,
+                "interruptions": self.interruptions,
+            }
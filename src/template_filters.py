@@ -4,8 +4,19 @@ from markupsafe import Markup
 from pytz import utc
 
 from config import TZ
+from src.status_buffer import TERMINAL_STATUS_RANK, status_rank
 from src.util import timestamp_round_up_minute
 
+# bootstrap color and font awesome icon of each job status, as in status.html
+JOB_STATUS_STYLES = (
+    ("scheduled", "info", "fa-sync-alt"),
+    ("running", "info", "fa-sync-alt"),
+    ("success", "success", "fa-check"),
+    ("failed", "danger", "fa-times"),
+    ("error", "warning", "fa-exclamation-triangle"),
+)
+UNKNOWN_JOB_STATUS_STYLE = ("warning", "fa-question-circle")
+
 
 class TemplateFilters:
     def __init__(self, app):
@@ -34,3 +45,14 @@ class TemplateFilters:
             # Format: Tue, Sep 10, 2024, 12:30pm (CDT)
             time_str = dt.strftime("%a, %b %-d, %Y, %-I:%M %p")
             return Markup(time_str)
+
+        @app.template_filter("job_status_style")
+        def _filter_job_status_style(status):
+            for name, color, icon in JOB_STATUS_STYLES:
+                if name in status:
+                    return color, icon
+            return UNKNOWN_JOB_STATUS_STYLE
+
+        @app.template_filter("job_status_active")
+        def _filter_job_status_active(status):
+            return 0 < status_rank(status) < TERMINAL_STATUS_RANK
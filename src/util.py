@@ -16,6 +16,17 @@ from pytz import utc
 from config import TZ, MAINTENANCE_MODE, MAINTENANCE_MODE_MESSAGE
 from src.types import GradeEntry
 
+try:
+    import numpy as np
+except ImportError:  # statistics are then computed in pure Python
+    np = None
+
+STATISTICS_ROUNDING_DIGITS = 3
+# scores are binned into SCORE_BIN_COUNT bins of SCORE_BIN_WIDTH points, the last bin also
+# holding all scores above it
+SCORE_BIN_WIDTH = 10
+SCORE_BIN_COUNT = 10
+
 
 def check_missing_fields(data, *args):
     """
@@ -137,6 +148,19 @@ def now_timestamp():
     return datetime.utcnow().replace(tzinfo=utc).timestamp()
 
 
+def local_date(timestamp):
+    """
+    Return the date of a UNIX timestamp in the server time zone as a "YYYY-MM-DD" string.
+    """
+    return (
+        datetime.utcfromtimestamp(timestamp)
+        .replace(tzinfo=utc)
+        .astimezone(TZ)
+        .date()
+        .isoformat()
+    )
+
+
 def is_valid_netid(netid):
     """
     Return true if the NetID passed in is a valid NetId
@@ -200,106 +224,158 @@ def test_slow_respond(func):
     return wrapper
 
 
+def _empty_statistics(name: str, entry_type: str) -> GradeEntry:
+    return GradeEntry(
+        name=name,
+        type=entry_type,
+        score=0,
+        min=0,
+        q1=0,
+        median=0,
+        q3=0,
+        max=0,
+        mean=0,
+        std=0,
+    )
+
+
+def _quartile_indices(n: int):
+    """
+    Indices of the first quartile, median and third quartile in n sorted scores. The median is
+    the lower median, and the quartiles are the lower medians of the two halves around it.
+    """
+    median_idx = (n - 1) // 2
+    return median_idx // 2, median_idx, median_idx + (n - median_idx) // 2
+
+
+def _round_statistics(name, entry_type, min_val, q1, median, q3, max_val, mean, std):
+    return GradeEntry(
+        name=name,
+        type=entry_type,
+        score=0,
+        min=round(float(min_val), STATISTICS_ROUNDING_DIGITS),
+        q1=round(float(q1), STATISTICS_ROUNDING_DIGITS),
+        median=round(float(median), STATISTICS_ROUNDING_DIGITS),
+        q3=round(float(q3), STATISTICS_ROUNDING_DIGITS),
+        max=round(float(max_val), STATISTICS_ROUNDING_DIGITS),
+        mean=round(float(mean), STATISTICS_ROUNDING_DIGITS),
+        std=round(float(std), STATISTICS_ROUNDING_DIGITS),
+    )
+
+
 def compute_statistics(name: str, entry_type: str, scores: List[float]) -> GradeEntry:
     """
     Compute statistics for an array of scores.
     """
-    ROUNDING_DIGITS = 3
     if not scores:
-        return GradeEntry(
-            name=name,
-            type=entry_type,
-            score=0,
-            min=0,
-            q1=0,
-            median=0,
-            q3=0,
-            max=0,
-            mean=0,
-            std=0
-        )
-
-    
+        return _empty_statistics(name, entry_type)
+
     n = len(scores)
-    
-    # First pass: compute sum for mean and find min/max
+    # summed left to right, like the NumPy implementation, so both give identical results
     total = 0
-    min_val = max_val = scores[0]
-    
     for score in scores:
         total += score
-        min_val = min(min_val, score)
-        max_val = max(max_val, score)
-    
     mean = total / n
-    
-    # Quick select implementation for O(n) median and quartiles
-    def quick_select(arr: List[float], k: int, left: int, right: int) -> float:
-        """
-        Quick select algorithm to find the kth smallest element in O(n) time
-        """
-        while True:
-            if left == right:
-                return arr[left]
-            
-            # Choose pivot (using middle element to avoid worst case for sorted arrays)
-            pivot_idx = (left + right) // 2
-            pivot = arr[pivot_idx]
-            
-            # Move pivot to the end
-            arr[pivot_idx], arr[right] = arr[right], arr[pivot_idx]
-            
-            # Partition
-            store_idx = left
-            for i in range(left, right):
-                if arr[i] < pivot:
-                    arr[store_idx], arr[i] = arr[i], arr[store_idx]
-                    store_idx += 1
-            
-            # Move pivot to its final place
-            arr[right], arr[store_idx] = arr[store_idx], arr[right]
-            
-            if store_idx == k:
-                return arr[k]
-            elif store_idx < k:
-                left = store_idx + 1
-            else:
-                right = store_idx - 1
-    
-    # Create a copy of scores to avoid modifying the original array
-    sorted_scores = scores.copy()
-    
-    # Find quartiles using quick select
-    median_idx = (n - 1) // 2
-    q1_idx = median_idx // 2
-    q3_idx = median_idx + (n - median_idx) // 2
-    
-    median = quick_select(sorted_scores, median_idx, 0, n - 1)
-    q1 = quick_select(sorted_scores, q1_idx, 0, median_idx)
-    q3 = quick_select(sorted_scores, q3_idx, median_idx, n - 1)
-    
-    # Second pass: compute standard deviation
+
+    sorted_scores = sorted(scores)
+    q1_idx, median_idx, q3_idx = _quartile_indices(n)
+
     squared_diff_sum = 0
     for score in scores:
         squared_diff_sum += (score - mean) ** 2
     std = math.sqrt(squared_diff_sum / n)
-    
-    return GradeEntry(
-        name=name,
-        type=entry_type,
-        score=0,
-        min=round(min_val, ROUNDING_DIGITS),
-        q1=round(q1, ROUNDING_DIGITS),
-        median=round(median, ROUNDING_DIGITS),
-        q3=round(q3, ROUNDING_DIGITS),
-        max=round(max_val, ROUNDING_DIGITS),
-        mean=round(mean, ROUNDING_DIGITS),
-        std=round(std, ROUNDING_DIGITS)
+
+    return _round_statistics(
+        name,
+        entry_type,
+        sorted_scores[0],
+        sorted_scores[q1_idx],
+        sorted_scores[median_idx],
+        sorted_scores[q3_idx],
+        sorted_scores[-1],
+        mean,
+        std,
     )
 
+
+def _compute_statistics_numpy(name: str, entry_type: str, scores) -> GradeEntry:
+    n = len(scores)
+    if n == 0:
+        return _empty_statistics(name, entry_type)
+    indices = _quartile_indices(n)
+    q1, median, q3 = np.partition(scores, indices)[list(indices)]
+    # cumsum adds left to right, where sum would add pairwise and round differently
+    mean = np.cumsum(scores)[-1] / n
+    std = math.sqrt(np.cumsum((scores - mean) ** 2)[-1] / n)
+    return _round_statistics(
+        name, entry_type, scores.min(), q1, median, q3, scores.max(), mean, std
+    )
+
+
 def bin_scores(scores):
-   bins = [0] * 10
-   for score in scores:
-       bin_idx = min(int(score // 10), 9)  
-       bins[bin_idx] += 1
-   return [[f"{i*10}-{min(100, (i+1)*10)}", count] for i, count in enumerate(bins)]
\ No newline at end of file
+    bins = [0] * SCORE_BIN_COUNT
+    for score in scores:
+        bin_idx = min(int(score // SCORE_BIN_WIDTH), SCORE_BIN_COUNT - 1)
+        bins[bin_idx] += 1
+    return _label_bins(bins)
+
+
+def _label_bins(bins):
+    return [
+        [f"{i * SCORE_BIN_WIDTH}-{min(100, (i + 1) * SCORE_BIN_WIDTH)}", int(count)]
+        for i, count in enumerate(bins)
+    ]
+
+
+def _bin_scores_numpy(scores):
+    bin_idx = np.minimum(scores // SCORE_BIN_WIDTH, SCORE_BIN_COUNT - 1).astype(int)
+    # negative indices count from the last bin, as in bin_scores
+    bin_idx[bin_idx < 0] += SCORE_BIN_COUNT
+    if len(bin_idx) and bin_idx.min() < 0:
+        raise IndexError("list index out of range")
+    return _label_bins(np.bincount(bin_idx, minlength=SCORE_BIN_COUNT))
+
+
+def summary_statistics(name: str, entry_type: str, summary) -> GradeEntry:
+    """
+    Round statistics computed by the database, as returned by db.summarize_course_grades,
+    into a GradeEntry with bins, the same as compute_statistics and bin_scores would give.
+    """
+    if not summary["n"]:
+        result = _empty_statistics(name, entry_type)
+        result["bins"] = bin_scores([])
+        return result
+    result = _round_statistics(
+        name,
+        entry_type,
+        summary["min"],
+        summary["q1"],
+        summary["median"],
+        summary["q3"],
+        summary["max"],
+        summary["mean"],
+        summary["std"],
+    )
+    result["bins"] = _label_bins(summary["bins"])
+    return result
+
+
+def compute_statistics_batch(entries) -> List[GradeEntry]:
+    """
+    Compute the statistics and score histogram of many arrays of scores, with NumPy if it is
+    installed and in pure Python otherwise. Both give the same results as compute_statistics
+    and bin_scores.
+    :param entries: a list of (name, entry_type, scores) tuples.
+    :return: a list of GradeEntry dicts with bins, in the order of entries.
+    """
+    results = []
+    for name, entry_type, scores in entries:
+        if np is None:
+            result = compute_statistics(name, entry_type, scores)
+            result["bins"] = bin_scores(scores)
+        else:
+            array = np.asarray(scores, dtype=float)
+            result = _compute_statistics_numpy(name, entry_type, array)
+            result["bins"] = _bin_scores_numpy(array)
+        results.append(result)
+    return results